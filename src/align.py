@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
 
-import sys, csv, argparse
+import sys, csv, argparse, gc, multiprocessing
 import rcc5, rows, checklist, workspace
-import theory, exemplar, estimate
+import theory, exemplar, estimate, name_cache
 import jumble
-import util
+import util, metrics
 
 from workspace import ingest_workspace, is_accepted_locally, local_sup, \
-  local_accepted, isinA, isinB, is_species
+  local_accepted, isinA, isinB, is_species, prepare_workspace_parts
 from checklist import *
 from rcc5 import *
 from specimen import same_typicals, sid_to_epithet
@@ -18,57 +18,143 @@ from property import mep, mep_get, mep_set
 from ranks import ranks_dict
 from util import reset_log_allowance
 
-counts = {}
+counts = metrics.counters("report")
+_count_events = None            # see report_chunk
+
 def count(tag):
-  if tag in counts: counts[tag] += 1
+  if _count_events != None:
+    _count_events.append(tag)
+  elif tag in counts: counts[tag] += 1
   else: counts[tag] = 1
 
 # Preorder traversal of AB.A
+# jumbled is true if the caller has already done jumble_workspace
 
-def generate_plugin_report(AB):
+def generate_plugin_report(AB, jumbled=False, jobs=1):
   yield generate_row(AB, True, True, True) # header
-  i = [0]
   frequency = 5000
 
-  jumble.jumble_workspace(AB)
-  spa = spb_spe = spb_nspe = spb_ne = 0
+  if not jumbled:
+    jumble.jumble_workspace(AB)
+  if jobs > 1:
+    yield from generate_rows_in_parallel(AB, jobs, frequency)
+    return
 
   seen = set()
 
-  for z in preorder_records(AB):
-    count("in jumble")
-    i[0] += 1
-    if i[0] % frequency == 0:
-      log("# %s %s" % (i[0], blurb(z)))
+  nodes = list(preorder_records(AB))
+  progress = metrics.progress("report", len(nodes))
+  i = 0
+  for z in nodes:
+    progress.step()
+    i += 1
+    if i % frequency == 0:
+      log("# %s %s" % (i, blurb(z)))
     ops = []
-
-    # A -
-    # - B
-    # A A
-    # A B
-    
-    assert not jumble.is_redundant(AB, z)
-
-    if is_species(z):
-      count("species in jumble")
-      spp = get_intersecting_species(AB, z)
-      if spp:
-        for w in spp:
-          count("species * species in jumble")
-          if isinA(AB, z):
-            u = z; v = w
-          else:
-            u = w; v = z
-          combo = (get_primary_key(u) if u else None,
-                   get_primary_key(v) if v else None)
-          if not combo in seen:
-            seen.add(combo)
-            yield generate_row(AB, u, v, ops)
-      else:
+    for (combo, u, v) in node_pairs(AB, z):
+      if combo == None:
+        yield generate_row(AB, u, v, ops)
+      elif not combo in seen:
+        seen.add(combo)
+        yield generate_row(AB, u, v, ops)
+
+# The (A, B) pairs that node z gets report rows for, as (combo, u, v).
+# combo is the pair of primary keys, for suppressing duplicate rows, or
+# None if the row is never a duplicate.
+
+def node_pairs(AB, z):
+  count("in jumble")
+
+  # A -
+  # - B
+  # A A
+  # A B
+
+  assert not jumble.is_redundant(AB, z)
+
+  if is_species(z):
+    count("species in jumble")
+    spp = get_intersecting_species(AB, z)
+    if spp:
+      for w in spp:
+        count("species * species in jumble")
         if isinA(AB, z):
-          yield generate_row(AB, z, None, ops)
+          u = z; v = w
         else:
-          yield generate_row(AB, None, z, ops)
+          u = w; v = z
+        combo = (get_primary_key(u) if u else None,
+                 get_primary_key(v) if v else None)
+        yield (combo, u, v)
+    else:
+      if isinA(AB, z):
+        yield (None, z, None)
+      else:
+        yield (None, None, z)
+
+# Report rows for ranges of the preorder sequence, made in forked
+# processes.  Each process sees the workspace as it was at the fork
+# (nothing changes it from here on) and returns, for its range, the
+# rows in order along with the count() calls made, so that the
+# duplicate suppression and the counts can be done here in the same
+# order as for one process.
+
+_report_AB = None               # inherited by forked workers
+_report_nodes = None
+
+def generate_rows_in_parallel(AB, jobs, frequency):
+  global _report_AB, _report_nodes
+  _report_AB = AB
+  _report_nodes = list(preorder_records(AB))
+  n = len(_report_nodes)
+  step = max(1, min(5000, n // (jobs * 16)))
+  ranges = [(start, min(n, start + step)) for start in range(0, n, step)]
+  log("* Generating report for %s nodes in %s processes" % (n, jobs))
+  seen = set()
+  progress = metrics.progress("report", n)
+  gc.freeze()                   # keep workers from copying the heap
+  try:
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+      for ((start, end), events) in zip(ranges,
+                                        pool.imap(report_chunk, ranges)):
+        for i in range(start, end):
+          if (i + 1) % frequency == 0:
+            log("# %s %s" % (i + 1, blurb(_report_nodes[i])))
+        progress.step(end - start)
+        for event in events:
+          if isinstance(event, str):
+            count(event)
+          else:
+            (combo, row, tags) = event
+            if combo != None:
+              if combo in seen: continue
+              seen.add(combo)
+            for tag in tags: count(tag)
+            yield row
+  finally:
+    gc.unfreeze()
+    _report_AB = _report_nodes = None
+
+# Returns a list of events: a count() tag, or (combo, row, tags) for a
+# row and the count() tags that making it produced
+
+def report_chunk(start_end):
+  global _count_events
+  (start, end) = start_end
+  AB = _report_AB
+  events = []
+  seen = set()                  # earlier ranges are checked by the caller
+  for z in _report_nodes[start:end]:
+    _count_events = events
+    for (combo, u, v) in node_pairs(AB, z):
+      if combo != None:
+        if combo in seen: continue
+        seen.add(combo)
+      tags = _count_events = []
+      row = generate_row(AB, u, v, [])
+      _count_events = events
+      events.append((combo, row, tags))
+  _count_events = None
+  return events
 
 def rcc5_counts_report(counts):
   reset_log_allowance()    # prints to stderr
@@ -140,14 +226,14 @@ def generate_row(AB, u, v, ops):
 def show_sid_set(AB, block):
   if True:
     sids = sorted(block, key=lambda sid: sid_to_epithet(AB, sid))
-    return "; ".join(map(show_sid, sids))
+    return "; ".join(map(lambda sid: show_sid(AB, sid), sids))
   else:
     # xep = (sid, epithet)
     xeps = sorted(map(lambda sid:(sid, sid_to_epithet(AB, sid)), block),
                   key=lambda xep: xep[1])
     return "; ".join(map(lambda xep:"%s %s" % xep, xeps))
 
-def show_sid(sid):
+def show_sid(AB, sid):
   ep = sid_to_epithet(AB, sid)
   return "%s %s" % (sid, ep)
 
@@ -174,10 +260,10 @@ def impute_concept_change(AB, u, v_rel, homotypic):
         from specimen import get_specimen_id, get_typical
         v = v_rel.record
         log("# u %s   %s" %
-            (show_sid(get_specimen_id(get_typical(u))),
+            (show_sid(AB, get_specimen_id(get_typical(u))),
              blurb(u)))
         log("# v %s   %s" %
-            (show_sid(get_specimen_id(get_typical(v))),
+            (show_sid(AB, get_specimen_id(get_typical(v))),
              blurb(v)))
     elif ship == LT:
       op = "expand" if homotypic else "lump"
@@ -289,11 +375,11 @@ def hamming(u, v):
   if p1.year != p2.year: h += 1
   return h
 
-def generate_report(AB, d_path):
+def generate_report(AB, d_path, jobs=1):
   with rows.open(d_path, "w") as d_gen:
     log("# logged 1??")              # doesn't get written
     # writes to io.open(...), a text stream  ??
-    d_gen.write_rows(generate_plugin_report(AB))
+    d_gen.write_rows(generate_plugin_report(AB, jobs=jobs))
     print("# resetting logging", file=sys.stderr)    # SUCCESS
     reset_log_allowance()
     print("# wrote rows 2", file=sys.stderr) # SUCCESS
@@ -312,25 +398,43 @@ if __name__ == '__main__':
                       default='A')
   parser.add_argument('--Bname', help="short name of the B checklist",
                       default='B')
+  parser.add_argument('--name-cache', dest='name_cache',
+                      help="file in which to keep parsed names between runs",
+                      default=None)
+  parser.add_argument('--jobs', type=int, default=1,
+                      help="""number of processes for parsing names, matching,
+                              and generating the report""")
+  parser.add_argument('--metrics', default=None,
+                      help="where to write run metrics (JSON, or CSV if path ends in .csv)")
   args=parser.parse_args()
+  metrics.write_summary_at_exit(args.metrics)
   a_name = args.Aname
   b_name = args.Bname
   d_path = '-'
   with rows.open(args.A) as a_rows:
     with rows.open(args.B) as b_rows:
       log("* Aligning")
-      AB = ingest_workspace(a_rows.rows(), b_rows.rows(),
-                            A_name=a_name, B_name=b_name)
+      with metrics.stage("ingest"):
+        AB = ingest_workspace(a_rows.rows(), b_rows.rows(),
+                              A_name=a_name, B_name=b_name)
+      if args.name_cache or args.jobs > 1:
+        with metrics.stage("parse names"):
+          name_cache.open_cache(args.name_cache)
+          prepare_workspace_parts(AB, args.jobs)
       if args.exemplars:
         log("*  Reading exemplars from file %s" % args.exemplars)
-        exemplar.read_exemplars(rows.open(args.exemplars), AB)
+        with metrics.stage("read exemplars"):
+          exemplar.read_exemplars(rows.open(args.exemplars), AB)
       else:
         log("*  Computing exemplars")
-        exemplar.find_exemplars(AB)
+        exemplar.find_exemplars(AB, jobs=args.jobs)
       log("# theorize")         # gets written.
       theory.theorize(AB, False)
-      find_estimates(AB)
-      generate_report(AB, d_path)
+      with metrics.stage("estimates"):
+        find_estimates(AB)
+      with metrics.stage("report"):
+        generate_report(AB, d_path, args.jobs)
+      name_cache.close_cache()
       log("# Wrote alignment...") # does not gets written !??
       rcc5_counts_report(counts)  # counts is global.  prints to stderr.
       log("* Wrote alignment\n")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+# Microbenchmark: generic ambient getters vs. plan-compiled getters
+# (property.compiled_getter), on source records and on workspace
+# records (which inherit most of their fields through cloned_from).
+
+import sys, time, argparse
+import property as prop
+import rows
+
+from util import log
+from checklist import canonical_prop, superior_prop, \
+  taxonomic_status_prop, all_records
+from workspace import ingest_workspace
+
+def time_getter(get, records, repeat):
+  start = time.perf_counter()
+  for _ in range(repeat):
+    for x in records:
+      get(x, None)
+  elapsed = time.perf_counter() - start
+  return (len(records) * repeat) / elapsed
+
+def run_bench(AB, repeat):
+  yield ("property", "records", "ambient/s", "compiled/s", "speedup")
+  sides = (("source", list(all_records(AB.A))),
+           ("workspace", [AB.in_left(x) for x in all_records(AB.A)]))
+  for (side, records) in sides:
+    for p in (canonical_prop, superior_prop, taxonomic_status_prop):
+      # Compiled getters fill in their accessors on first use; warm up
+      compiled = prop.compiled_getter(p)
+      for x in records: compiled(x, None)
+      before = time_getter(prop.ambient_getter(p), records, repeat)
+      after = time_getter(compiled, records, repeat)
+      yield (p.label, side, "%.0f" % before, "%.0f" % after,
+             "%.2f" % (after / before))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="""
+    Time getter throughput for a few hot properties, with and without
+    plan-compiled accessors.  Report is written to standard output.
+    """)
+  parser.add_argument('--A', help="the A checklist, as path name or newick",
+                      default="((a,b)c,(d,e*)f)g")
+  parser.add_argument('--B', help="the B checklist, as path name or newick",
+                      default="((a,b)c,(d,e)f)g")
+  parser.add_argument('--repeat', type=int, default=20,
+                      help="passes over the records per measurement")
+  args=parser.parse_args()
+  with rows.open(args.A) as a_rows:
+    with rows.open(args.B) as b_rows:
+      AB = ingest_workspace(a_rows.rows(), b_rows.rows())
+  for row in run_bench(AB, args.repeat):
+    print("%-22s %-10s %12s %12s %8s" % row)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+# Benchmarks for the alignment pipeline.
+#
+# Runs the pipeline stages one at a time on fixed inputs and records,
+# for each stage, wall clock time, CPU time, and the peak resident set
+# size of the process so far.  Inputs are the small checklists in
+# bench/ and synthetic checklist pairs of (roughly) a given number of
+# records, as DwC or as Newick.  Each input is run in a process of its
+# own, so that peak RSS figures are comparable.
+#
+# Results are written as JSON.  Given a baseline (the JSON from an
+# earlier run), stages that have become slower or bigger than allowed
+# are reported, and the exit status is 1 if there are any.
+
+import sys, os, io, csv, json, time, random, resource, platform, argparse
+import multiprocessing
+
+import util, rows, newick, checklist, workspace, exemplar, block, \
+  cross_mrca, estimate, jumble, align
+from util import log
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, "bench")
+
+STAGES = ("rows_to_checklist", "make_workspace", "find_exemplars",
+          "analyze_blocks", "compute_cross_mrcas", "find_estimates",
+          "jumble_workspace", "generate_plugin_report")
+
+# -----------------------------------------------------------------------------
+# Running the stages
+
+class StageTimer:
+  def __init__(self):
+    self.stages = {}
+
+  def run(self, name, fn, *args):
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = fn(*args)
+    self.stages[name] = {
+      'wall': round(time.perf_counter() - wall, 4),
+      'cpu': round(time.process_time() - cpu, 4),
+      'peak_rss_mb': round(peak_rss_mb(), 1)}
+    log("-- benchmark: %s %s" % (name, self.stages[name]))
+    return result
+
+def peak_rss_mb():
+  kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == 'darwin': kb = kb / 1024   # bytes there
+  return kb / 1024
+
+def run_stages(A_spec, B_spec):
+  T = StageTimer()
+  def ingest():
+    with rows.open(A_spec) as a_rows:
+      A = checklist.rows_to_checklist(a_rows.rows(), {'tag': "A"})
+    with rows.open(B_spec) as b_rows:
+      B = checklist.rows_to_checklist(b_rows.rows(), {'tag': "B"})
+    return (A, B)
+  (A, B) = T.run("rows_to_checklist", ingest)
+  AB = T.run("make_workspace", workspace.make_workspace, A, B, {'tag': "AB"})
+  T.run("find_exemplars", exemplar.find_exemplars, AB)
+  T.run("analyze_blocks", block.analyze_blocks, AB)
+  T.run("compute_cross_mrcas", cross_mrca.compute_cross_mrcas, AB)
+  T.run("find_estimates", estimate.find_estimates, AB)
+  T.run("jumble_workspace", jumble.jumble_workspace, AB)
+  report = T.run("generate_plugin_report",
+                 lambda: sum(1 for row in
+                             align.generate_plugin_report(AB, jumbled=True)))
+  records = (sum(1 for x in checklist.all_records(A)) +
+             sum(1 for y in checklist.all_records(B)))
+  return {'records': records, 'report_rows': report, 'stages': T.stages}
+
+def run_in_process(A_spec, B_spec):
+  with multiprocessing.get_context('fork').Pool(1) as pool:
+    return pool.apply(run_stages, (A_spec, B_spec))
+
+# -----------------------------------------------------------------------------
+# Inputs.  Names are 'small' (bench/small-A.csv and bench/small-B.csv),
+# a size such as 10k, 100k or 1m (synthetic DwC), or newick-<size>.
+
+def input_specs(name, workdir):
+  if name == 'small':
+    return (os.path.join(BENCH_DIR, "small-A.csv"),
+            os.path.join(BENCH_DIR, "small-B.csv"))
+  as_newick = name.startswith("newick-")
+  size = parse_count(name[len("newick-"):] if as_newick else name)
+  paths = tuple(os.path.join(workdir, "synthetic-%s-%s.csv" % (size, which))
+                for which in "AB")
+  if not all(os.path.exists(path) for path in paths):
+    log("-- benchmark: generating %s synthetic records" % size)
+    os.makedirs(workdir, exist_ok=True)
+    for (path, checklist_rows) in zip(paths, synthetic_checklists(size)):
+      with open(path, 'w') as outport:
+        util.write_rows(checklist_rows, outport)
+  if as_newick:
+    specs = []
+    for path in paths:
+      with rows.open(path) as r:
+        specs.append(newick.compose_newick(r.rows()))
+    return tuple(specs)
+  return paths
+
+def parse_count(s):
+  s = s.lower()
+  for (suffix, factor) in (('k', 1000), ('m', 1000000)):
+    if s.endswith(suffix):
+      return int(float(s[:-1]) * factor)
+  return int(s)
+
+# Synthetic A and B, with about size records between them.  B is A
+# with some species dropped, moved to another genus, or demoted to
+# synonyms, and some subspecies and synonyms dropped.
+
+SYLLABLES = ['ba','ca','da','fe','ge','hi','ki','lo','mu','ne','po','ra',
+             'si','tu','vi','xo','ze']
+AUTHORS = ['Smith','Jones','Linnaeus','Gray','Thomas','Allen','Peters',
+           'Miller']
+HEADER = ('taxonID','parentNameUsageID','acceptedNameUsageID',
+          'taxonomicStatus','taxonRank','canonicalName','scientificName',
+          'scientificNameAuthorship')
+
+def synthetic_checklists(size, seed=1):
+  r = random.Random(seed)
+  def word(k): return ''.join(r.choice(SYLLABLES) for _ in range(k))
+  def auth():
+    a = '%s, %s' % (r.choice(AUTHORS), r.randint(1758, 2000))
+    return '(%s)' % a if r.random() < 0.3 else a
+  # families -> genera -> species (epithet, authorship, subspecies, synonyms)
+  families = []
+  count = 0
+  while count < size // 2:
+    f = len(families)
+    genera = []
+    for g in range(r.randint(1, 5)):
+      species = []
+      for s in range(r.randint(1, 7)):
+        ep = word(3)
+        subs = ([ep] + [word(3) for _ in range(r.choice([0, 0, 1, 2]))]
+                if r.random() < 0.3 else [])
+        syns = [(word(3), auth()) for _ in range(r.choice([0, 0, 0, 1, 2]))]
+        species.append((ep, auth(), subs, syns))
+        count += 1 + len(subs) + len(syns)
+      genera.append(('G%s%d' % (word(2), f), species))
+      count += 1
+    families.append(('F%sidae' % word(2), genera))
+    count += 1
+  return (synthetic_rows(families, 'a', None),
+          synthetic_rows(families, 'b', random.Random(seed + 7)))
+
+def synthetic_rows(families, tag, perturb):
+  yield HEADER
+  n = [0]
+  def new():
+    n[0] += 1
+    return '%s%d' % (tag, n[0])
+  def chance(p): return perturb and perturb.random() < p
+  top = new()
+  yield (top, '', '', 'accepted', 'order', 'Ordo', 'Ordo', '')
+  for (fname, genera) in families:
+    fname = fname.capitalize()
+    fid = new()
+    yield (fid, top, '', 'accepted', 'family', fname, fname, '')
+    for (gname, species) in genera:
+      gname = gname.capitalize()
+      gid = new()
+      yield (gid, fid, '', 'accepted', 'genus', gname, gname, '')
+      previous = None
+      for (ep, au, subs, syns) in species:
+        if chance(0.04): continue
+        g2 = gname
+        if chance(0.04):
+          g2 = genera[0][0].capitalize()
+          if not au.startswith('('): au = '(%s)' % au
+        name = '%s %s' % (g2, ep)
+        sid = new()
+        if previous and chance(0.05):
+          yield (sid, '', previous, 'synonym', 'species',
+                 name, name + ' ' + au, au)
+          continue
+        yield (sid, gid, '', 'accepted', 'species', name, name + ' ' + au, au)
+        previous = sid
+        for e2 in subs:
+          if chance(0.15): continue
+          name2 = '%s %s %s' % (g2, ep, e2)
+          yield (new(), sid, '', 'accepted', 'subspecies',
+                 name2, name2 + ' ' + au, au)
+        for (e3, a3) in syns:
+          if chance(0.2): continue
+          name3 = '%s %s' % (gname, e3)
+          yield (new(), '', sid, 'synonym', 'species',
+                 name3, name3 + ' ' + a3, a3)
+
+# -----------------------------------------------------------------------------
+# Comparison with a baseline
+
+# Returns a list of (input, stage, what, baseline, now) for stages
+# that have regressed by more than the allowed fraction.  Stages
+# taking less than min_time seconds are too noisy to judge by time.
+
+def find_regressions(results, baseline, time_threshold, rss_threshold,
+                     min_time=0.05):
+  regressions = []
+  for (name, result) in results['inputs'].items():
+    before = baseline['inputs'].get(name)
+    if not before: continue
+    for (stage, now) in result['stages'].items():
+      was = before['stages'].get(stage)
+      if not was: continue
+      for what in ('wall', 'cpu'):
+        if (was[what] >= min_time and
+            now[what] > was[what] * (1 + time_threshold)):
+          regressions.append((name, stage, what, was[what], now[what]))
+      if now['peak_rss_mb'] > was['peak_rss_mb'] * (1 + rss_threshold):
+        regressions.append((name, stage, 'peak_rss_mb',
+                            was['peak_rss_mb'], now['peak_rss_mb']))
+  return regressions
+
+def report_comparison(results, baseline):
+  for (name, result) in results['inputs'].items():
+    before = baseline['inputs'].get(name)
+    if not before: continue
+    for (stage, now) in result['stages'].items():
+      was = before['stages'].get(stage)
+      if was and was['wall'] > 0:
+        log("-- %s %-24s wall %8.3f -> %8.3f (%+.0f%%)" %
+            (name, stage, was['wall'], now['wall'],
+             100 * (now['wall'] / was['wall'] - 1)))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="""
+    Time the stages of the alignment pipeline on benchmark inputs, and
+    write wall time, CPU time, and peak RSS per stage as JSON.
+    """)
+  parser.add_argument('--inputs', default="small,10k",
+                      help="""comma separated: small, a number of records
+                              such as 10k, 100k or 1m, or newick-<number>""")
+  parser.add_argument('--workdir', default=os.path.join("work", "bench"),
+                      help="where to keep generated synthetic inputs")
+  parser.add_argument('--output', default='-',
+                      help="where to write the JSON results")
+  parser.add_argument('--baseline', default=None,
+                      help="JSON results of an earlier run, to compare with")
+  parser.add_argument('--time-threshold', dest='time_threshold', type=float,
+                      default=0.25,
+                      help="allowed fractional increase in time (default 0.25)")
+  parser.add_argument('--rss-threshold', dest='rss_threshold', type=float,
+                      default=0.25,
+                      help="allowed fractional increase in peak RSS (default 0.25)")
+  args=parser.parse_args()
+
+  results = {'version': util.VERSION,
+             'python': platform.python_version(),
+             'machine': platform.machine(),
+             'inputs': {}}
+  for name in args.inputs.split(','):
+    log("* Benchmark input %s" % name)
+    (A_spec, B_spec) = input_specs(name, args.workdir)
+    results['inputs'][name] = run_in_process(A_spec, B_spec)
+
+  with rows.open(args.output, 'w') as out:
+    json.dump(results, out.file, indent=2)
+    out.file.write('\n')
+
+  if args.baseline:
+    with open(args.baseline) as inport:
+      baseline = json.load(inport)
+    report_comparison(results, baseline)
+    regressions = find_regressions(results, baseline,
+                                   args.time_threshold, args.rss_threshold)
+    for (name, stage, what, was, now) in regressions:
+      log("** Regression: %s %s %s %s -> %s" % (name, stage, what, was, now))
+    if regressions:
+      sys.exit(1)
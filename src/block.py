@@ -17,6 +17,8 @@ from rcc5 import *
 e_sightings = 0
 
 def analyze_blocks(ws):
+  global exemplar_positions
+  exemplar_positions = ExemplarPositions()
   def doit(AB):
     def traverse(x):
       global e_sightings
@@ -58,10 +60,13 @@ def analyze_blocks(ws):
   log("# top block size: %s" % len(b1))
 
 def adjoin_exemplar(exemplar_id, e):
+  if BITSETS:
+    return combine_blocks(e, exemplar_positions.singleton(exemplar_id))
   return combine_blocks(e, {exemplar_id})
 
 # -----------------------------------------------------------------------------
-# Implementation of blocks as Python sets of 'exemplars'.
+# Implementation of blocks as Python sets of 'exemplars' (or Bits,
+# see below).
 # A 'block' is just a set of exemplars, implemented as ... a python set.
 # The term 'block' comes from the mathematical treatment of partitions.
 
@@ -102,10 +107,109 @@ def combine_blocks(e1, e2):
   if e2 == BOTTOM_BLOCK: return e1
   return e1 | e2
 
-BOTTOM_BLOCK = set()
 def same_block(e1, e2): return e1 == e2
 def is_empty_block(e): return e == BOTTOM_BLOCK
 
+# -----------------------------------------------------------------------------
+# Alternative implementation of blocks as bitsets.
+#
+# Each exemplar is given a bit position, in the order in which the
+# traversal of A first sees it (postorder), so the exemplars under a
+# node of A occupy a contiguous run of positions, and those under a
+# node of B mostly do too.  A Bits is a Python int holding the bits
+# starting at the block's lowest position, together with that
+# position, so a block takes space proportional to the extent of its
+# run rather than to the number of exemplars overall.  (Blocks along
+# monotypic chains were already shared: combine_blocks returns its
+# nonempty argument as is.)
+#
+# A Bits behaves like a set of exemplar ids for the operations that
+# are done on blocks: ==, &, |, -, <=, issubset, isdisjoint, len, and
+# iteration (in increasing exemplar id order).
+
+BITSETS = True
+
+class ExemplarPositions:
+  def __init__(self):
+    self.position = {}          # exemplar id -> bit position
+    self.sids = []              # bit position -> exemplar id
+
+  def singleton(self, sid):
+    i = self.position.get(sid)
+    if i == None:
+      i = len(self.sids)
+      self.position[sid] = i
+      self.sids.append(sid)
+    return Bits(self, 1, i)
+
+exemplar_positions = None
+
+class Bits:
+  __slots__ = ('positions', 'bits', 'low')
+
+  # Invariant: bits is 0 (empty block) or odd
+  def __init__(self, positions, bits, low):
+    self.positions = positions
+    self.bits = bits
+    self.low = low
+
+  def __eq__(self, other):
+    return (isinstance(other, Bits) and
+            self.bits == other.bits and
+            (self.low == other.low or self.bits == 0))
+  def __hash__(self):
+    return hash((self.bits, self.low if self.bits else 0))
+  def __bool__(self):
+    return self.bits != 0
+  def __len__(self):
+    return self.bits.bit_count()
+
+  def __iter__(self):
+    sids = self.positions.sids if self.positions else ()
+    digits = bin(self.bits)[:1:-1]   # lowest bit first
+    low = self.low
+    yield from sorted(sids[low + i] for i in range(len(digits))
+                      if digits[i] == '1')
+
+  def __or__(self, other):
+    (a, b, low) = _align(self, other)
+    return _bits(self, other, a | b, low)
+  def __and__(self, other):
+    (a, b, low) = _align(self, other)
+    return _bits(self, other, a & b, low)
+  def __sub__(self, other):
+    (a, b, low) = _align(self, other)
+    return _bits(self, other, a & ~b, low)
+
+  def issubset(self, other):
+    (a, b, low) = _align(self, other)
+    return a & ~b == 0
+  def isdisjoint(self, other):
+    (a, b, low) = _align(self, other)
+    return a & b == 0
+  def __le__(self, other): return self.issubset(other)
+  def __ge__(self, other): return other.issubset(self)
+  def __lt__(self, other): return self != other and self.issubset(other)
+  def __gt__(self, other): return self != other and other.issubset(self)
+
+  def __repr__(self):
+    return "Bits(%s)" % list(self)
+
+# Line up the bits of two blocks, returning (bits1, bits2, low)
+
+def _align(e1, e2):
+  if not e1.bits: return (0, e2.bits, e2.low)
+  if not e2.bits: return (e1.bits, 0, e1.low)
+  low = min(e1.low, e2.low)
+  return (e1.bits << (e1.low - low), e2.bits << (e2.low - low), low)
+
+def _bits(e1, e2, bits, low):
+  if bits == 0: return BOTTOM_BLOCK
+  shift = (bits & -bits).bit_length() - 1
+  return Bits(e1.positions or e2.positions, bits >> shift, low + shift)
+
+BOTTOM_BLOCK = Bits(None, 0, 0) if BITSETS else set()
+
 # --------------------
 # For debugging
 
@@ -9,7 +9,7 @@ import property as prop
 from util import log, MISSING
 from rcc5 import *
 from ranks import ranks_dict     # not very abstract
-import parse
+import parse, name_cache
 
 # Strings (field values)
 primary_key_prop = prop.declare_property("taxonID")
@@ -58,8 +58,10 @@ outject_prop = prop.declare_property("outject")
 (get_accepted_key, set_accepted_key) = prop.get_set(accepted_key_prop)
 get_superior_note = prop.getter(superior_note_prop)
 (get_superior, set_superior) = prop.get_set(superior_prop)
-(get_children, set_children) = prop.get_set(prop.declare_property("children", inherit=False))
-(get_synonyms, set_synonyms) = prop.get_set(prop.declare_property("synonyms", inherit=False))
+children_prop = prop.declare_property("children", inherit=False)
+synonyms_prop = prop.declare_property("synonyms", inherit=False)
+(get_children, set_children) = prop.get_set(children_prop)
+(get_synonyms, set_synonyms) = prop.get_set(synonyms_prop)
 
 get_gn_full = prop.getter(prop.declare_property("gn_canonical_full"))
 get_gn_stem = prop.getter(prop.declare_property("gn_canonical_stem"))
@@ -147,6 +149,9 @@ class Source:
     self.indexed = False    # get_children, get_synonyms set?
     make_top(self)          # Superior of last resort
     self.workspace = None
+    self.hierarchy = None   # see index_hierarchy
+    self.lca_index = None   # see simple.get_lca_index
+    self.rank_index = None  # see simple.get_rank_index
 
 def all_records(C):             # not including top
   col = prop.get_column(primary_key_prop, C.context)
@@ -157,23 +162,115 @@ def all_records_inclusive(C):   # including top
   yield from all_records(C)
   yield C.top
 
+# Traversals are iterative, not recursive, so that deep hierarchies
+# (NCBI) don't run into Python's recursion limit.
+
 def preorder_records(C):        # starting from top
   assert C.top
-  def traverse(x):
+  H = C.hierarchy
+  if H:
+    yield from H.records
+    return
+  stack = [C.top]
+  while stack:
+    x = stack.pop()
     assert isinstance(x, prop.Record)
     yield x
-    for c in get_inferiors(x):
-      assert isinstance(c, prop.Record)
-      yield from traverse(c)
-  yield from traverse(C.top)
+    stack.extend(reversed(tuple(get_inferiors(x))))
 
 def postorder_records(C):       # ending with top
   assert C.top
-  def traverse(x):
-    for c in get_inferiors(x):
-      yield from traverse(c)
-    yield x
-  yield from traverse(C.top)
+  H = C.hierarchy
+  if H:
+    for i in H.postorder:
+      yield H.records[i]
+    return
+  stack = [(C.top, False)]
+  while stack:
+    (x, expanded) = stack.pop()
+    if expanded:
+      yield x
+    else:
+      stack.append((x, True))
+      stack.extend((c, False) for c in reversed(tuple(get_inferiors(x))))
+
+# -----------------------------------------------------------------------------
+# Hierarchy index for a source checklist, built once at ingest time.
+#
+# Records are numbered in preorder starting with 0 for top.  The
+# subtree (inferiors, transitively, including synonyms) of record
+# number i occupies numbers i through end[i], so ancestor/descendant
+# and disjointness tests are interval comparisons.  Children and
+# synonyms are kept in CSR form: the children of i are
+# child_list[child_start[i]:child_start[i+1]], and likewise synonyms.
+# The hierarchy must not be relinked after the index is built.
+
+class Hierarchy(NamedTuple):
+  records : Any          # preorder number -> record
+  position : Any         # mep: record -> preorder number
+  end : Any              # preorder number of last record in subtree
+  depth : Any            # top is 0
+  parent : Any           # preorder number of superior, -1 for top
+  postorder : Any        # preorder numbers in postorder
+  child_start : Any
+  child_list : Any
+  synonym_start : Any
+  synonym_list : Any
+
+def index_hierarchy(C):
+  records = []
+  position = prop.mep()
+  depth = []
+  parent = []
+  stack = [(C.top, -1)]
+  while stack:
+    (x, p) = stack.pop()
+    i = len(records)
+    records.append(x)
+    prop.mep_set(position, x, i)
+    parent.append(p)
+    depth.append(depth[p] + 1 if p >= 0 else 0)
+    stack.extend((c, i) for c in reversed(tuple(get_inferiors(x))))
+  n = len(records)
+
+  # Subtree extents, accumulated from the bottom up
+  size = [1] * n
+  for i in range(n-1, 0, -1):
+    size[parent[i]] += size[i]
+  end = [i + size[i] - 1 for i in range(n)]
+
+  child_start = [0]; child_list = []
+  synonym_start = [0]; synonym_list = []
+  for x in records:
+    child_list.extend(prop.mep_get(position, c) for c in get_children(x, ()))
+    child_start.append(len(child_list))
+    synonym_list.extend(prop.mep_get(position, c) for c in get_synonyms(x, ()))
+    synonym_start.append(len(synonym_list))
+
+  # Postorder: inferiors in order, then the record itself
+  postorder = []
+  stack = [(0, False)]
+  while stack:
+    (i, expanded) = stack.pop()
+    if expanded:
+      postorder.append(i)
+    else:
+      stack.append((i, True))
+      stack.extend((j, False) for j in
+                   reversed(synonym_list[synonym_start[i]:synonym_start[i+1]]))
+      stack.extend((j, False) for j in
+                   reversed(child_list[child_start[i]:child_start[i+1]]))
+
+  C.hierarchy = Hierarchy(records, position, end, depth, parent, postorder,
+                          child_start, child_list,
+                          synonym_start, synonym_list)
+  return C.hierarchy
+
+# Preorder number of x in its source's hierarchy index, or None if
+# there's no index or x isn't reachable from top
+
+def hierarchy_position(H, x):
+  return prop.mep_get(H.position, x, None)
 
 def get_workspace(u):
   return get_source(u).workspace
@@ -188,6 +285,9 @@ def get_workspace(u):
 # iterable -> source checklist
 
 def rows_to_checklist(iterabl, meta):
+  import snapshot               # snapshot.py imports this module
+  if isinstance(iterabl, snapshot.Snapshot):
+    return iterabl.to_checklist(meta)
   S = Source(meta)
   # Three passes: read, link, reverse link
   (Q, register) = rows_to_context(iterabl, primary_key_prop)
@@ -198,28 +298,43 @@ def rows_to_checklist(iterabl, meta):
   for record in prop.get_records(column):
     count += 1
     set_source(record, S)       # not same as EOL "source" column
+  # Superiors may come after inferiors (e.g. Newick), so link separately
+  for record in prop.get_records(column):
     resolve_superior(S, record)
   roots = list(get_inferiors(S.top))
   if len(roots) > 1:
     log("-- %s roots" % len(roots))
   # Poor man's cycle detection
-  count2 = 0
-  for row in preorder_rows(S):
-    count2 += 1
+  count2 = len(index_hierarchy(S).records)
   if count != count2-1:
     log("!!! count disagreement: %s rows, %s reachable" % (count, count2))
   return S
 
 # Property scoping context ...
 
+# Keep ingested rows in a column store (see property.py) rather than
+# one list per row.  INT_KEYS says to store numeric ids as ints.
+
+COLUMNAR = True
+INT_KEYS = True
+INT_KEY_PROPS = (primary_key_prop, parent_key_prop, accepted_key_prop)
+
 def rows_to_context(row_iterable, primary_key_prop):
   Q = prop.make_context()
   register = prop.get_registrar(primary_key_prop, Q)
   row_iterator = iter(row_iterable)
   plan = prop.make_plan_from_header(next(row_iterator))
-  for row in row_iterator:
-    assert (isinstance(row, tuple) or isinstance(row, list)), row
-    register(prop.construct(plan, row))
+  if COLUMNAR:
+    int_props = INT_KEY_PROPS if INT_KEYS else ()
+    store = prop.make_store(plan, int_props=int_props)
+    for row in row_iterator:
+      assert (isinstance(row, tuple) or isinstance(row, list)), row
+      register(prop.construct_in(store, row))
+    store.seal()
+  else:
+    for row in row_iterator:
+      assert (isinstance(row, tuple) or isinstance(row, list)), row
+      register(prop.construct(plan, row))
   return (Q, register)
 
 # Two ways to make these things.  One is using plans (with `construct`).
@@ -694,20 +809,58 @@ u1 -> v1 -> u2 -> v3
 # Result of parsing = Parts
 # Cached on workspace records
 
-(get_parts_cache, set_parts_cache) = prop.get_set(prop.declare_property("parts_cache", inherit=False))
+parts_cache_prop = prop.declare_property("parts_cache", inherit=False)
+(get_parts_cache, set_parts_cache) = prop.get_set(parts_cache_prop)
 
 def get_parts(x):
   probe = get_parts_cache(x, None)
   if probe: return probe
-  parts = parse.parse_name(get_best_name(x),
-                           gn_full = get_gn_full(x, MISSING),
-                           gn_stem = get_gn_stem(x, MISSING),
-                           gn_auth = get_gn_auth(x, MISSING),
-                           canonical = get_canonical(x, MISSING),
-                           authorship = get_authorship(x, MISSING))
+  w = get_outject(x, None)      # workspace record; source may have it
+  if w:
+    probe = get_parts_cache(w, None)
+    if probe:
+      set_parts_cache(x, probe)
+      return probe
+  fields = name_fields(x)
+  parts = name_cache.lookup(fields)
+  if not parts:
+    parts = name_cache.parse_fields(fields)
+    name_cache.remember(fields, parts)
   set_parts_cache(x, parts)
   return parts
 
+# Everything that parse_name looks at
+
+def name_fields(x):
+  return (get_best_name(x),
+          get_gn_full(x, MISSING),
+          get_gn_stem(x, MISSING),
+          get_gn_auth(x, MISSING),
+          get_canonical(x, MISSING),
+          get_authorship(x, MISSING))
+
+# Bulk pre-pass: parse all of a source checklist's names up front,
+# using the name cache and then (for the rest) jobs processes
+
+def prepare_parts(C, jobs=1):
+  todo = []
+  cached = 0
+  for x in all_records(C):
+    if get_parts_cache(x, None): continue
+    fields = name_fields(x)
+    parts = name_cache.lookup(fields)
+    if parts:
+      set_parts_cache(x, parts)
+      cached += 1
+    else:
+      todo.append((x, fields))
+  parsed = name_cache.parse_many([fields for (x, fields) in todo], jobs)
+  for ((x, fields), parts) in zip(todo, parsed):
+    set_parts_cache(x, parts)
+    name_cache.remember(fields, parts)
+  log("# %s: %s names parsed, %s found in cache" %
+      (get_tag(C), len(todo), cached))
+
 def get_tipe(x, default=None):
   parts = get_parts(x)
   return (parts.epithet, parts.token, parts.year)
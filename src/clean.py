@@ -5,13 +5,20 @@
 #  - Makes sure all rows have the same number of fields
 
 import sys, csv, regex, hashlib, argparse
+import multiprocessing
+import compressed, dwca
 from util import csv_parameters, windex, stable_hash, log, MISSING
 
 def start_csv(inport, params, outport, args):
+  (d, q, g) = params
+  start_rows(csv.reader(inport, delimiter=d, quotechar=q, quoting=g),
+             outport, args)
+
+# reader is an iterator of rows, header first (e.g. dwca.archive_rows)
+
+def start_rows(reader, outport, args):
   cleanp = args.clean
 
-  (d, q, g) = params
-  reader = csv.reader(inport, delimiter=d, quotechar=q, quoting=g)
   in_header = next(reader)
   # Use built-in python csv sniffer ??
   if len(in_header) == 1:
@@ -77,45 +84,40 @@ def start_csv(inport, params, outport, args):
   # Do these after header modifications
   pk_pos_out = windex(out_header, pk_col)
 
-  writer = csv.writer(outport) # CSV not TSV
-  writer.writerow(out_header)
-  count = 0
-  trimmed = 0
-  names_cleaned = 0
-  ranks_cleaned = 0
-  accepteds_normalized = 0
-  minted = 0
-  seen_pks = {}
-  previous_pk = 0
-  conflicts = 0
-  senior = 0
-  managed = 0
   # In COL 2023 we get:
   # _csv.Error: field larger than field limit (131072)
   csv.field_size_limit(131072 * 4)
-  for in_row in reader:
 
+  # Everything that can be done to a row without looking at other
+  # rows.  Returns
+  #   (out_row, taxon_id, in_row, flags, messages, conflict)
+  # where flags = (trimmed, normalized, cleaned, managed), and
+  # out_row is None if the row is to be dropped.
+
+  def prepare_row(in_row):
+    messages = []
     taxon_id = in_row[taxon_id_pos]
 
     for field in in_row:
       if len(field) > 10000:
-        log("** %s: Very long row: length %s" % (taxon_id, count))
+        messages.append("** %s: Very long row: length %s" %
+                        (taxon_id, len(field)))
 
     # Deal with raggedness if any
+    was_trimmed = False
     if len(in_row) > len(in_header):
       in_row = in_row[0:len(in_header)]
-      trimmed += 1
+      was_trimmed = True
     elif len(in_row) < len(in_header):
-      log(("** %s: Not enough columns: have %s want %s" %
-           (taxon_id, len(in_row), len(in_header))))
+      messages.append(("** %s: Not enough columns: have %s want %s" %
+                       (taxon_id, len(in_row), len(in_header))))
 
     # Filter out senior synonyms... is this right?
     if tax_status_pos != None and in_row[tax_status_pos] == "senior synonym":
-      senior += 1
-      continue
+      return (None, taxon_id, in_row, (was_trimmed, False, False, False),
+              messages, None)
 
-    if normalize_accepted(in_row, taxon_id_pos, parent_pos, accepted_pos):
-      accepteds_normalized += 1
+    normalized = normalize_accepted(in_row, taxon_id_pos, parent_pos, accepted_pos)
 
     out_row = in_row + [MISSING] * (len(out_header) - len(in_row))
 
@@ -126,6 +128,7 @@ def start_csv(inport, params, outport, args):
                       stat.startswith("dubious") or
                       stat.endswith("accepted"))  #"provisionally accepted" seen in GBIF
     else:
+      stat = MISSING
       indication_2 = True
 
     # Two ways to test whether a usage is accepted/dubious
@@ -133,10 +136,10 @@ def start_csv(inport, params, outport, args):
     au = in_row[accepted_pos] if accepted_pos != None else MISSING
     indication_1 = (au == MISSING or au == taxon_id)
 
-    if indication_1 != indication_2 and conflicts < 10:
-      log("** %s: Accepted is '%s' but taxstatus '%s'" %
-          (taxon_id, au, stat))
-    conflicts += 1
+    conflict = None
+    if indication_1 != indication_2:
+      conflict = ("** %s: Accepted is '%s' but taxstatus '%s'" %
+                  (taxon_id, au, stat))
 
     # landmark_status is specific to EOL
     if landmark_pos != None: 
@@ -155,15 +158,65 @@ def start_csv(inport, params, outport, args):
       out_row[source_pos] = in_row[source_pos].split(',', 1)[0]
 
     # Clean up if wrong values in canonical and/or scientific name columns
+    cleaned = False
     if cleanp:
-      if clean_name(out_row, can_pos, sci_pos, auth_pos):
-        names_cleaned += 1
+      cleaned = clean_name(out_row, can_pos, sci_pos, auth_pos)
       if auth_pos != None:      # clean_auth ...
         a = in_row[auth_pos]
         a = a.strip()
         if a.endswith(').'): a = a[0:-1] # for MDD
         out_row[auth_pos] = a
 
+    # Add managed_id if necessary
+    has_managed = False
+    if args.managed:            # --managed prefix:column
+      if managed_col_pos < len(in_row):
+        id = in_row[managed_col_pos]
+        managed_id = "%s:%s" % (prefix, id) if id else MISSING
+        has_managed = True
+      else:
+        managed_id = MISSING
+      out_row[managed_id_pos] = managed_id
+
+    return (out_row, taxon_id, in_row,
+            (was_trimmed, normalized, cleaned, has_managed),
+            messages, conflict)
+
+  if args.jobs > 1:
+    prepared = prepare_in_parallel(reader, prepare_row, args.jobs)
+  else:
+    prepared = map(prepare_row, reader)
+
+  # Things that depend on what came before: keys and counts
+
+  writer = csv.writer(outport) # CSV not TSV
+  writer.writerow(out_header)
+  count = 0
+  trimmed = 0
+  names_cleaned = 0
+  ranks_cleaned = 0
+  accepteds_normalized = 0
+  minted = 0
+  seen_pks = {}
+  previous_pk = 0
+  conflicts = 0
+  senior = 0
+  managed = 0
+  for (out_row, taxon_id, in_row, flags, messages, conflict) in prepared:
+    for message in messages: log(message)
+    (was_trimmed, normalized, cleaned, has_managed) = flags
+    if was_trimmed: trimmed += 1
+    if out_row == None:
+      senior += 1
+      continue
+    if normalized: accepteds_normalized += 1
+    if cleaned: names_cleaned += 1
+    if has_managed: managed += 1
+
+    if conflict and conflicts < 10:
+      log(conflict)
+    conflicts += 1
+
     # Add primary key if duplicate(?) or missing
     if taxon_id == MISSING:
       taxon_id = fresh_pk(in_row, out_header)
@@ -177,16 +230,6 @@ def start_csv(inport, params, outport, args):
     assert taxon_id != MISSING
     seen_pks[taxon_id] = True
 
-    # Add managed_id if necessary
-    if args.managed:            # --managed prefix:column
-      if managed_col_pos < len(in_row):
-        id = in_row[managed_col_pos]
-        managed_id = "%s:%s" % (prefix, id) if id else MISSING
-        managed += 1
-      else:
-        managed_id = MISSING
-      out_row[managed_id_pos] = managed_id
-
     assert len(out_row) == len(out_header)
     writer.writerow(out_row)
     count += 1
@@ -204,8 +247,47 @@ def start_csv(inport, params, outport, args):
     # Ignoring extra values is appropriate behavior for DH 0.9.  But
     # elsewhere we might want ragged input to be treated as an error.
     log("-- clean: trimmed extra values from %s rows" % (trimmed,))
-    
+
+# Apply prepare_row to chunks of rows in worker processes, yielding
+# results in input order.  Rows are parsed here and in the workers
+# only cleaned.  Since the workers can't know which keys are
+# duplicates, they send the would-be fresh key along in place of the
+# input row (see fresh_pk).
+
+CHUNK_SIZE = 10000
+_prepare_row = None             # for workers
+
+def prepare_in_parallel(reader, prepare_row, jobs):
+  global _prepare_row
+  _prepare_row = prepare_row
+  log("-- clean: cleaning in %s processes" % jobs)
+  with multiprocessing.get_context('fork').Pool(jobs) as pool:
+    for results in pool.imap(_prepare_chunk, chunks(reader, CHUNK_SIZE)):
+      yield from results
+
+def _prepare_chunk(rows):
+  results = []
+  for row in rows:
+    (out_row, taxon_id, in_row, flags, messages, conflict) = _prepare_row(row)
+    if out_row != None:
+      in_row = fresh_pk(in_row, None)
+    results.append((out_row, taxon_id, in_row, flags, messages, conflict))
+  return results
+
+def chunks(reader, size):
+  chunk = []
+  for row in reader:
+    chunk.append(row)
+    if len(chunk) >= size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+# row is an input row, or (from a worker) its fresh key
+
 def fresh_pk(row, out_header):
+  if isinstance(row, str): return row
   try:
     return stable_hash("^".join(row))
   except:
@@ -347,7 +429,9 @@ if __name__ == '__main__':
     CSV rows are written to standard output.
     """)
   parser.add_argument('--input', default=None,
-                      help="""name of input file.  TSV assumed unless
+                      help="""name of input file, which may be compressed
+                              (.gz, .xz, .zst), or a Darwin Core archive
+                              (.zip).  TSV assumed unless
                               name contains ".csv".  Default to CSV from stdin""")
   parser.add_argument('--pk', default=None,
                       help='name of column containing primary key')
@@ -356,6 +440,8 @@ if __name__ == '__main__':
   parser.add_argument('--no-clean', dest='clean', action='store_false')
   parser.add_argument('--managed',
                       help='prefix and source column for managed record ids, e.g. eol:EOLid')
+  parser.add_argument('--jobs', type=int, default=1,
+                      help='number of processes for cleaning rows')
   parser.set_defaults(clean=True)
 
   args=parser.parse_args()
@@ -363,7 +449,10 @@ if __name__ == '__main__':
   if inpath == None:
     params = csv_parameters("foo.csv")
     start_csv(sys.stdin, params, sys.stdout, args)
+  elif dwca.is_archive(inpath):
+    with dwca.open_archive(inpath) as archive:
+      start_rows(dwca.archive_rows(archive), sys.stdout, args)
   else:
     params = csv_parameters(args.input)
-    with open(args.input, "r") as inport:
+    with compressed.open_file(args.input, "r") as inport:
       start_csv(inport, params, sys.stdout, args)
@@ -0,0 +1,140 @@
+# Opening files that might be compressed (gzip, xz, or zstd).
+#
+# open_file is like io.open, except that a file whose name ends in .gz,
+# .xz, .zst or .zstd, or (when reading) that starts with the magic
+# bytes of one of those formats, is decompressed on reading and
+# compressed on writing.  Decompression happens in a background thread
+# a chunk or so ahead of the reader, so that it overlaps with whatever
+# the reader is doing (usually parsing CSV).
+#
+# zstd needs the zstandard package; gzip and xz are in the standard
+# library.
+
+import os, io, gzip, lzma, queue, threading
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None              # .zst files can't be read or written
+
+CHUNK_SIZE = 1 << 20            # bytes per read-ahead chunk
+READ_AHEAD = 8                  # chunks decompressed ahead of the reader
+
+SUFFIXES = (('.gz', 'gzip'), ('.xz', 'xz'), ('.zst', 'zstd'), ('.zstd', 'zstd'))
+MAGIC = ((b'\x1f\x8b', 'gzip'),
+         (b'\xfd7zXZ\x00', 'xz'),
+         (b'\x28\xb5\x2f\xfd', 'zstd'))
+
+# 'gzip', 'xz', 'zstd', or None
+
+def compression_by_name(path):
+  for (suffix, method) in SUFFIXES:
+    if path.endswith(suffix):
+      return method
+  return None
+
+def compression_by_content(path):
+  if not os.path.isfile(path):  # don't consume a pipe's bytes
+    return None
+  try:
+    with io.open(path, 'rb') as inport:
+      start = inport.read(6)
+  except OSError:
+    return None
+  for (magic, method) in MAGIC:
+    if start.startswith(magic):
+      return method
+  return None
+
+# The name without its compression suffix, e.g. for telling CSV from TSV
+
+def strip_suffix(path):
+  for (suffix, method) in SUFFIXES:
+    if path.endswith(suffix):
+      return path[:-len(suffix)]
+  return path
+
+# mode is as for io.open.  With read_ahead=False, a compressed file is
+# read in the calling thread, and a binary one can seek (slowly).
+
+def open_file(path, mode='r', newline=None, read_ahead=True):
+  writing = ('w' in mode or 'a' in mode)
+  if writing:
+    method = compression_by_name(path)
+  else:
+    method = compression_by_name(path) or compression_by_content(path)
+  if method == None:
+    return io.open(path, mode, newline=newline)
+  stream = compressing_stream(path, method, writing)
+  if not writing and read_ahead:
+    stream = io.BufferedReader(ReadAhead(stream), CHUNK_SIZE)
+  if 'b' in mode:
+    return stream
+  return io.TextIOWrapper(stream, encoding='utf-8', newline=newline)
+
+def compressing_stream(path, method, writing):
+  mode = 'wb' if writing else 'rb'
+  if method == 'gzip':
+    return gzip.open(path, mode)
+  elif method == 'xz':
+    return lzma.open(path, mode)
+  assert method == 'zstd', method
+  if zstandard == None:
+    raise OSError("the zstandard package is needed for %s" % path)
+  binary = io.open(path, mode)
+  if writing:
+    return zstandard.ZstdCompressor().stream_writer(binary, closefd=True)
+  return zstandard.ZstdDecompressor().stream_reader(binary, closefd=True)
+
+# A read-only raw stream whose bytes are read from another stream by a
+# background thread, at most READ_AHEAD chunks ahead.
+
+class ReadAhead(io.RawIOBase):
+  def __init__(self, stream):
+    self.stream = stream
+    self.chunks = queue.Queue(READ_AHEAD)
+    self.chunk = b''
+    self.offset = 0
+    self.eof = False
+    self.stopping = False
+    self.thread = threading.Thread(target=self.fill, daemon=True)
+    self.thread.start()
+
+  def fill(self):
+    try:
+      while not self.stopping:
+        data = self.stream.read(CHUNK_SIZE)
+        self.chunks.put(data)
+        if not data: return
+    except BaseException as e:
+      self.chunks.put(e)        # raised in the reader's thread
+
+  def readable(self):
+    return True
+
+  def readinto(self, b):
+    while self.offset >= len(self.chunk):
+      if self.eof: return 0
+      data = self.chunks.get()
+      if isinstance(data, BaseException):
+        self.eof = True
+        raise data
+      if not data:
+        self.eof = True
+        return 0
+      (self.chunk, self.offset) = (data, 0)
+    n = min(len(b), len(self.chunk) - self.offset)
+    b[:n] = self.chunk[self.offset:self.offset + n]
+    self.offset += n
+    return n
+
+  def close(self):
+    if not self.closed:
+      self.stopping = True
+      while self.thread.is_alive():   # unblock it if it's waiting to put
+        try:
+          self.chunks.get(timeout=0.1)
+        except queue.Empty:
+          pass
+      self.stream.close()
+    super().close()
@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 
 import property as prop
-import simple
+import simple, metrics
 
 from util import log
-from checklist import get_outject, get_inferiors
+from checklist import get_outject, get_inferiors, hierarchy_position, blurb
 from workspace import separated, isinA, swap
 from specimen import get_exemplar_info
 
@@ -29,6 +29,9 @@ BOTTOM = None
 def compute_cross_mrcas(AB):
   count = [0]
   def do_cross_mrcas(WS):        # WS is AB or swap(AB)
+    if WS.A.hierarchy and WS.B.hierarchy:
+      count[0] += bulk_cross_mrcas(AB, WS)
+      return
     def traverse(x):            # arg in A, result in B
       u = WS.in_left(x)          # in WS
       exem = get_exemplar_info(u)       # exemplar record (not uf)
@@ -58,3 +61,32 @@ def compute_cross_mrcas(AB):
   do_cross_mrcas(AB)
   do_cross_mrcas(swap(AB))
   log("# %s cross_mrcas set" % count[0])
+  metrics.gauge("cross_mrcas", count[0])
+
+# Same as the traversal above, for indexed checklists: a single
+# bottom-up pass over A's postorder, carrying B preorder numbers and
+# combining them with B's LCA index.  Returns number of cross_mrcas set.
+
+def bulk_cross_mrcas(AB, WS):
+  HA = WS.A.hierarchy
+  HB = WS.B.hierarchy
+  lca = simple.get_lca_index(WS.B).lca
+  ms = [BOTTOM] * len(HA.records)       # A number -> B number
+  count = 0
+  for i in HA.postorder:
+    u = WS.in_left(HA.records[i])
+    m = ms[i]                           # from inferiors
+    exem = get_exemplar_info(u)
+    if exem:
+      (_, u1, v1) = exem
+      y = get_outject(v1) if isinA(AB, u) else get_outject(u1)
+      j = hierarchy_position(HB, y)
+      assert j != None, blurb(y)
+      m = j if m == BOTTOM else lca(m, j)
+    if m != BOTTOM:
+      set_cross_mrca(u, WS.in_right(HB.records[m]))
+      count += 1
+      p = HA.parent[i]
+      if p >= 0:
+        ms[p] = m if ms[p] == BOTTOM else lca(ms[p], m)
+  return count
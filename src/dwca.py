@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Read the taxon table of a Darwin Core archive (DwC-A) directly from
+# the .zip file, without unpacking it.
+#
+# The archive's meta.xml says which file in the archive holds the
+# taxon table (the core, or else an extension with rowType Taxon), how
+# it's delimited, quoted and encoded, how many header lines to skip,
+# and which column holds which term.  Rows come out with a header of
+# short term names (http://rs.tdwg.org/dwc/terms/taxonID -> taxonID),
+# as clean.py expects.
+#
+# An archive without meta.xml is read the way find_taxa.py would find
+# its taxon file: the first taxon.tsv or similar, with its own header.
+
+import sys, io, os, csv, zipfile, argparse
+import xml.etree.ElementTree as ET
+
+from util import csv_parameters
+
+TAXON_ROW_TYPE = "http://rs.tdwg.org/dwc/terms/Taxon"
+
+TAXON_FILE_NAMES = [os.path.join(d, "%s.%s" % (f, x))
+                    for d in ("", "backbone")
+                    for f in ("taxon", "taxa", "Taxon", "Taxa")
+                    for x in ("csv", "tsv", "txt")]
+
+csv.field_size_limit(131072 * 4)
+
+def is_archive(path):
+  return path.endswith(".zip")
+
+# Where and how the taxon table is stored
+
+class TableMeta:
+  def __init__(self, location, delimiter=",", quotechar='"',
+               encoding="utf-8", header_lines=0, columns=None):
+    self.location = location          # file name within the archive
+    self.delimiter = delimiter
+    self.quotechar = quotechar        # None if fields aren't quoted
+    self.encoding = encoding
+    self.header_lines = header_lines  # lines to skip
+    self.columns = columns            # [(short name, index, default)], or
+                                      # None to use the file's own header
+
+# -----------------------------------------------------------------------------
+# meta.xml
+
+def read_meta(xml_text):
+  root = ET.fromstring(xml_text)
+  tables = [e for e in root if local_name(e.tag) in ("core", "extension")]
+  for table in tables:
+    if table.get("rowType") == TAXON_ROW_TYPE:
+      return table_meta(table)
+  assert tables, "no core in meta.xml"
+  print("-- dwca: no Taxon table; using core, rowType %s" %
+        tables[0].get("rowType"), file=sys.stderr)
+  return table_meta(tables[0])
+
+def table_meta(table):
+  location = None
+  columns = []
+  id_index = None
+  for e in table.iter():
+    tag = local_name(e.tag)
+    if tag == "location" and location == None:
+      location = e.text.strip()
+    elif tag == "id":
+      id_index = int(e.get("index"))
+    elif tag == "field":
+      index = e.get("index")
+      columns.append((short_name(e.get("term")),
+                      int(index) if index != None else None,
+                      e.get("default", "")))
+  # The id column usually has no field element of its own
+  if id_index != None and not any(i == id_index for (_, i, _) in columns):
+    columns.insert(0, ("taxonID", id_index, ""))
+  quote = unescape(table.get("fieldsEnclosedBy", '"'))
+  return TableMeta(location,
+                   delimiter=unescape(table.get("fieldsTerminatedBy", ",")),
+                   quotechar=quote or None,
+                   encoding=table.get("encoding", "utf-8"),
+                   header_lines=int(table.get("ignoreHeaderLines", "0")),
+                   columns=columns)
+
+def local_name(tag):                  # '{namespace}core' -> 'core'
+  return tag.rsplit('}', 1)[-1]
+
+# http://rs.tdwg.org/dwc/terms/taxonID -> taxonID
+# http://purl.org/dc/terms/source -> source
+
+def short_name(term):
+  return term.rstrip('/').rsplit('/', 1)[-1].rsplit('#', 1)[-1]
+
+def unescape(s):                      # meta.xml writes tab as \t
+  return s.replace("\\t", "\t").replace("\\n", "\n").replace("\\r", "\r")
+
+# -----------------------------------------------------------------------------
+# Reading the taxon table
+
+def archive_meta(archive):
+  names = archive.namelist()
+  meta_names = [n for n in names if os.path.basename(n) == "meta.xml"]
+  if meta_names:
+    meta_name = min(meta_names, key=len)    # the one at the top
+    meta = read_meta(archive.read(meta_name))
+    meta.location = os.path.join(os.path.dirname(meta_name), meta.location)
+    return meta
+  for name in TAXON_FILE_NAMES:
+    found = [n for n in names if n == name or n.endswith("/" + name)]
+    if found:
+      (d, q, g) = csv_parameters(found[0])
+      return TableMeta(found[0], delimiter=d,
+                       quotechar=q if g != csv.QUOTE_NONE else None)
+  assert False, "no meta.xml or taxon file in archive"
+
+# Yields the header (short names) and then the rows of the taxon table
+
+def archive_rows(archive):
+  meta = archive_meta(archive)
+  print("-- dwca: reading %s" % meta.location, file=sys.stderr)
+  with archive.open(meta.location) as binary:
+    text = io.TextIOWrapper(binary, encoding=meta.encoding, newline='')
+    if meta.quotechar:
+      reader = csv.reader(text, delimiter=meta.delimiter,
+                          quotechar=meta.quotechar)
+    else:
+      reader = csv.reader(text, delimiter=meta.delimiter,
+                          quotechar="\a", quoting=csv.QUOTE_NONE)
+    if meta.columns == None:
+      yield from reader
+      return
+    for _ in range(meta.header_lines):
+      next(reader, None)
+    yield [name for (name, _, _) in meta.columns]
+    places = [(index, default) for (_, index, default) in meta.columns]
+    for row in reader:
+      if not row: continue
+      yield [(row[index] or default)
+             if index != None and index < len(row) else default
+             for (index, default) in places]
+
+def open_archive(path):
+  return zipfile.ZipFile(path)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="""
+    Write the taxon table of a Darwin Core archive (.zip) to standard
+    output as CSV, with short column names.
+    """)
+  parser.add_argument('archive', help="the .zip file")
+  args = parser.parse_args()
+  with open_archive(args.archive) as archive:
+    csv.writer(sys.stdout).writerows(archive_rows(archive))
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 import property as prop
-import checklist, workspace, simple, ranks
+import checklist, workspace, simple, ranks, metrics
 
 from util import log
 from checklist import *
@@ -38,6 +38,8 @@ def find_estimates(AB):
   findem(AB)
   findem(swap(AB))              # swap is in checklist
   log("# Estimates: %s (=), %s (<)" % (int(counts[0]/2), counts[1]))
+  metrics.gauge("estimates =", int(counts[0]/2))
+  metrics.gauge("estimates <", counts[1])
 
 # Blocks have not been computed at this point (but they could be)
 
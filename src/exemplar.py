@@ -5,7 +5,7 @@
 from parse import PROBE
 
 import sys, argparse
-import util, rows
+import util, rows, name_cache, metrics
 
 from util import log, windex
 from workspace import *
@@ -23,12 +23,15 @@ from typify import find_endohomotypics
 # listtools's exemplar-finding procedure.  If there is some other way
 # of finding exemplars, that's fine, don't need to use this.
 
-def find_exemplars(AB):
-  find_endohomotypics(AB)       # Within each checklist
+def find_exemplars(AB, jobs=1):
+  with metrics.stage("endohomotypics"):
+    find_endohomotypics(AB)       # Within each checklist
 
-  subproblems = find_subproblems(AB)
+  with metrics.stage("subproblems"):
+    subproblems = find_subproblems(AB)
   log("* Finding typicals (single pass):")
-  find_typicals(AB, subproblems, None, True)
+  with metrics.stage("typicals"):
+    find_typicals(AB, subproblems, None, True, jobs=jobs)
 
   # maybe compute better estimates - see theory.py
   report_on_exemplars(AB)
@@ -110,7 +113,9 @@ def index_by_some_key(AB, fn):
 # z is in AB
 
 def get_subproblem_key(z):
-  x = get_outject(z)
+  return record_subproblem_key(get_outject(z))
+
+def record_subproblem_key(x):   # x is in A or B
   parts = get_parts(x)
   ep = parts.epithet            # stemmed
   key = ep if ep else parts.genus
@@ -140,6 +145,7 @@ def report_on_exemplars(AB):
         get_exemplar_id(uf)        # forces sid assignment  ??
   log("# Nodes with type specimens: %s, nodes with exemplars: %s, specimen id UFs: %s" %
       (ufcount, count, len(AB.specimens)))
+  metrics.gauge("nodes with exemplars", count)
 
 # Write exemplars to a file
 
@@ -175,17 +181,20 @@ def generate_exemplars(AB):
 # Read list of exemplars from file (given as a Rows)
 
 def read_exemplars(in_rows, AB):
-  assert len(AB.specimens) == 0
-  equate_typicals(AB.in_left(AB.A.top), AB.in_right(AB.B.top))
   the_rows = in_rows.rows()     # caller will close in_rows
   header = next(the_rows)
   sid_col = windex(header, "exemplar id")
   which_col = windex(header, "checklist")
   taxonid_col = windex(header, "taxonID")
-  for row in the_rows:
-    taxonid = row[taxonid_col]
-    which = row[which_col]
-    sid = int(row[sid_col])
+  apply_exemplars(AB, ((int(row[sid_col]), row[which_col], row[taxonid_col])
+                       for row in the_rows))
+
+# Install exemplars given as (sid, 'A' or 'B', taxonID) triples
+
+def apply_exemplars(AB, triples):
+  assert len(AB.specimens) == 0
+  equate_typicals(AB.in_left(AB.A.top), AB.in_right(AB.B.top))
+  for (sid, which, taxonid) in triples:
     if which == 'A':
       C = AB.A
     elif which == 'B':
@@ -222,7 +231,15 @@ if __name__ == '__main__':
                       default='A')
   parser.add_argument('--Bname', help="short name of the B checklist",
                       default='B')
+  parser.add_argument('--name-cache', dest='name_cache',
+                      help="file in which to keep parsed names between runs",
+                      default=None)
+  parser.add_argument('--jobs', type=int, default=1,
+                      help="number of processes for parsing names and matching")
+  parser.add_argument('--metrics', default=None,
+                      help="where to write run metrics (JSON, or CSV if path ends in .csv)")
   args=parser.parse_args()
+  metrics.write_summary_at_exit(args.metrics)
 
   a_name = args.Aname
   b_name = args.Bname
@@ -232,9 +249,16 @@ if __name__ == '__main__':
     with rows.open(b_path) as b_rows:
       # compute name matches afresh
       log("* Finding exemplars")
-      AB = ingest_workspace(a_rows.rows(), b_rows.rows(),
-                            A_name=a_name, B_name=b_name)
-      find_exemplars(AB)
-      write_exemplar_list(AB)
+      with metrics.stage("ingest"):
+        AB = ingest_workspace(a_rows.rows(), b_rows.rows(),
+                              A_name=a_name, B_name=b_name)
+      if args.name_cache or args.jobs > 1:
+        with metrics.stage("parse names"):
+          name_cache.open_cache(args.name_cache)
+          prepare_workspace_parts(AB, args.jobs)
+      find_exemplars(AB, jobs=args.jobs)
+      with metrics.stage("write exemplars"):
+        write_exemplar_list(AB)
+      name_cache.close_cache()
       log("* Wrote exemplars\n")
 
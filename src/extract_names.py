@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
 
-import sys, csv
+import sys, csv, argparse
 from util import windex, MISSING, log
 import regex
 
 year_re_string = '\\b([12][0-9]{3})\\b'
 year_re = regex.compile(year_re_string)
 
+parser = argparse.ArgumentParser(description="""
+  Standard input is a cleaned checklist.  Writes one name per row to
+  standard output, for gnparser.
+  """)
+parser.add_argument('--ids', action='store_true',
+                    help="""write CSV with columns Id (row number) and name,
+                            so that use_gnparse.py --by-id can join by Id""")
+args = parser.parse_args()
+
+if args.ids:
+  id_writer = csv.writer(sys.stdout)
+  id_writer.writerow(("Id", "name"))
+
 reader = csv.reader(sys.stdin)
 header = next(reader)
 sci_pos = windex(header, "scientificName")
@@ -20,9 +33,11 @@ rank_pos = windex(header, "taxonRank")
 log("# Columns: sci %s can %s status %s" % (sci_pos, can_pos, status_pos))
 poly_count = 0
 sci_count = 0
+row_count = 0
 
 for row in reader:
   assert len(row) == len(header), (len(row), len(header), row, header)
+  row_count += 1
   name = MISSING
   if sci_pos != None:
     name = row[sci_pos]
@@ -62,7 +77,10 @@ for row in reader:
     name = 'Xyzzy' + name[1:]     # Undone in use_gnparse.py
   name = name.replace('?', 'xyzzy')
 
-  print(name, file=sys.stdout)
+  if args.ids:
+    id_writer.writerow((row_count, name))
+  else:
+    print(name, file=sys.stdout)
 if poly_count > 0:
   log("# Synthesized %s polynomials" % poly_count)
 log("# Found %s scientific names" % sci_count)
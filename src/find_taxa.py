@@ -2,27 +2,34 @@
 
 # Get the name of the DwC taxa file in a GBIF or CoL DwCA archive.
 # GBIF moved the taxa file from dump/ to dump/backbone/ in 2022.
-# Argument is path to directory where dumped.
+# Argument is path to directory where dumped, or the .zip itself.
 
-# Ideally we should find meta.xml and read it to find out the name,
-# but that would require me learning how to parse and crawl XML in
-# python.
+# The name comes from meta.xml if there is one (see dwca.py), otherwise
+# from looking for likely file names.  A .zip is left as is: clean.py
+# and rows.open read the taxon table out of it directly.
 
 import sys, os
+import dwca
 
 def find(dir):
-  for dir in (dir, os.path.join(dir, "backbone")):
-    for f in ("taxon", "taxa", "Taxon", "Taxa"):
-      for x in ("csv", "tsv", "txt"):
-        name = os.path.join(dir, "%s.%s" % (f, x))
-        if os.path.isfile(name):
-          return name
+  meta_path = os.path.join(dir, "meta.xml")
+  if os.path.isfile(meta_path):
+    with open(meta_path, 'rb') as inport:
+      name = os.path.join(dir, dwca.read_meta(inport.read()).location)
+    if os.path.isfile(name):
+      return name
+  for name in dwca.TAXON_FILE_NAMES:
+    name = os.path.join(dir, name)
+    if os.path.isfile(name):
+      return name
 
 dir = sys.argv[1]
-name = find(dir)
+if dwca.is_archive(dir) and os.path.isfile(dir):
+  name = dir
+else:
+  name = find(dir)
 if name:
   print(name)
 else:
   print("Didn't find a .taxon file or similar in %s" % dir, file=sys.stderr)
   sys.exit(1)
-
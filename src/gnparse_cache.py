@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+# Front end to gnparser that remembers its output from one run to the
+# next.
+#
+# Reads names, one per line, as written by extract_names.py, and
+# writes gnparser's CSV output for them, in the same order, so that it
+# can stand in for `gnparser -s` in the pipeline
+#
+#   extract_names.py | gnparse_cache.py --cache gn.cache | use_gnparse.py
+#
+# Names that are in the cache are answered from it, and only the rest
+# are sent to gnparser (each distinct name once).  The cache is keyed
+# by a hash of the name string and holds at most --limit entries; when
+# it's full, the entries least recently used are dropped.
+#
+# With --ids, the input is the Id,name CSV written by
+# `extract_names.py --ids`, and the Id column of the output carries
+# those Ids instead of gnparser's, so that use_gnparse.py --by-id can
+# join by Id.  --shard K/N then parses only the rows with Id mod N = K,
+# so that the names can be parsed by N processes at once (or one
+# failed shard run again) and the outputs merged by use_gnparse.py.
+
+import sys, os, io, csv, pickle, hashlib, argparse, subprocess, shlex
+from collections import OrderedDict
+
+from util import log, windex
+
+CACHE_FORMAT = 1
+
+class GnparseCache:
+  def __init__(self, path, limit):
+    self.path = path
+    self.limit = limit
+    self.header = None          # gnparser's header row
+    self.rows = OrderedDict()   # key -> gnparser row; oldest use first
+    self.dirty = False
+    if path and os.path.exists(path):
+      with io.open(path, 'rb') as inport:
+        saved = pickle.load(inport)
+      if saved.get('format') == CACHE_FORMAT:
+        self.header = saved['header']
+        self.rows = saved['rows']
+        log("# %s gnparser results from %s" % (len(self.rows), path))
+      else:
+        log("# Discarding gnparser cache in format %s" % saved.get('format'))
+
+  def get(self, name):
+    key = name_key(name)
+    row = self.rows.get(key)
+    if row != None:
+      self.rows.move_to_end(key)
+      self.dirty = True         # recency has changed
+    return row
+
+  def put(self, name, row):
+    self.rows[name_key(name)] = row
+    self.dirty = True
+
+  def save(self):
+    if not (self.path and self.dirty): return
+    evicted = 0
+    while len(self.rows) > self.limit:
+      self.rows.popitem(last=False)
+      evicted += 1
+    temp = self.path + ".tmp"
+    with io.open(temp, 'wb') as outport:
+      pickle.dump({'format': CACHE_FORMAT,
+                   'header': self.header,
+                   'rows': self.rows},
+                  outport, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, self.path)
+    self.dirty = False
+    log("# %s gnparser results saved to %s (%s evicted)" %
+        (len(self.rows), self.path, evicted))
+
+def name_key(name):
+  return hashlib.blake2b(name.encode('utf-8'), digest_size=16).digest()
+
+# Returns a generator of gnparser output rows, header first, one row
+# per name
+
+def cached_gnparse(names, cache, command):
+  names = list(names)
+  results = [cache.get(name) for name in names]
+  unseen = list(OrderedDict.fromkeys(name for (name, row)
+                                     in zip(names, results)
+                                     if row == None))
+  log("-- gnparse_cache: %s names, %s distinct names not in cache" %
+      (len(names), len(unseen)))
+  if unseen or cache.header == None:
+    (header, fresh) = run_gnparser(unseen, command)
+    if cache.header != None and header != cache.header:
+      log("** gnparse_cache: gnparser header has changed; ignoring cache")
+      cache.rows.clear()
+      cache.header = header
+      cache.dirty = True
+      yield from cached_gnparse(names, cache, command)
+      return
+    cache.header = header
+    for (name, row) in zip(unseen, fresh):
+      cache.put(name, row)
+    results = [row if row != None else cache.get(name)
+               for (name, row) in zip(names, results)]
+  yield cache.header
+  yield from results
+
+# Put our Ids in gnparser's Id column
+
+def stamp_ids(gn_rows, ids):
+  header = next(gn_rows)
+  id_pos = windex(header, "Id")
+  yield header
+  for (row, id) in zip(gn_rows, ids):
+    row = list(row)
+    row[id_pos] = id
+    yield row
+
+# Id,name rows -> (Id, name) pairs, for one shard
+
+def read_ids(in_rows, shard):
+  header = next(in_rows)
+  (id_pos, name_pos) = (windex(header, "Id"), windex(header, "name"))
+  if shard:
+    (k, n) = map(int, shard.split('/'))
+  for row in in_rows:
+    if shard and int(row[id_pos]) % n != k: continue
+    yield (row[id_pos], row[name_pos])
+
+# Send names to gnparser, returning its header and one row per name
+
+def run_gnparser(names, command):
+  text = ''.join(name + '\n' for name in names)
+  proc = subprocess.run(shlex.split(command), input=text, text=True,
+                        stdout=subprocess.PIPE, check=True)
+  gn_rows = csv.reader(io.StringIO(proc.stdout))
+  header = tuple(next(gn_rows))
+  fresh = [tuple(row) for row in gn_rows]
+  assert len(fresh) == len(names), \
+    ("gnparser returned %s rows for %s names" % (len(fresh), len(names)))
+  return (header, fresh)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="""
+    Standard input is names, one per line, as written by
+    extract_names.py.  Standard output is what gnparser would write for
+    them.  Only names not found in the cache are given to gnparser.
+    """)
+  parser.add_argument('--cache', default=None,
+                      help="file in which gnparser output is kept between runs")
+  parser.add_argument('--limit', type=int, default=10000000,
+                      help="maximum number of names to keep in the cache")
+  parser.add_argument('--gnparser', default="gnparser -s",
+                      help="command to run gnparser")
+  parser.add_argument('--ids', action='store_true',
+                      help="input is Id,name CSV from extract_names.py --ids")
+  parser.add_argument('--shard', default=None,
+                      help="K/N: with --ids, parse only rows with Id mod N = K")
+  args=parser.parse_args()
+  cache = GnparseCache(args.cache, args.limit)
+  if args.ids:
+    pairs = list(read_ids(csv.reader(sys.stdin), args.shard))
+    gn_rows = stamp_ids(cached_gnparse((name for (id, name) in pairs),
+                                       cache, args.gnparser),
+                        (id for (id, name) in pairs))
+  else:
+    assert not args.shard, "--shard requires --ids"
+    names = (line.rstrip('\n') for line in sys.stdin)
+    gn_rows = cached_gnparse(names, cache, args.gnparser)
+  writer = csv.writer(sys.stdout)
+  for row in gn_rows:
+    writer.writerow(row)
+  cache.save()
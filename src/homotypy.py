@@ -6,6 +6,11 @@
 import util
 import simple
 
+try:
+  import numpy
+except ImportError:
+  numpy = None                  # compare_names_many is then unavailable
+
 from util import log, MISSING, VERSION
 from checklist import get_parts, get_rank, get_inferiors, \
   get_canonical, blurb, blorb, monitor, get_outject, \
@@ -268,6 +273,25 @@ def compare_names_1(name1, name2):
   (misses, hits) = parts_comparison_detail(name1, name2)
   return classify_comparison_details(misses, hits)
 
+# Two names can compare_names_1 as MOTION or better only if they have
+# a candidate key in common: HOMOTYPIC and MOTION need epithet, token
+# and year hits, and CORRECTION needs epithet and genus hits and a
+# token or year hit.  A name without an epithet never hits.
+
+def candidate_keys(p):
+  if p.epithet == None: return ()
+  # Treat 'Foo' like 'Foo foo', as parts_comparison_detail does
+  ep = p.genus.lower() if p.epithet == '' and p.genus else p.epithet
+  keys = []
+  if p.token != None and p.year != None:
+    keys.append(('token year', ep, p.token, p.year))
+  if p.genus != None:
+    if p.token != None:
+      keys.append(('genus token', ep, p.genus, p.token))
+    if p.year != None:
+      keys.append(('genus year', ep, p.genus, p.year))
+  return keys
+
 # Given a comparison of parts, classify it as appropriate
 
 # Parts masks
@@ -341,6 +365,77 @@ def parts_comparison_detail(p, q):
 
   return (misses, hits)
 
+# -----------------------------------------------------------------------------
+# The same comparison for many pairs at once, using numpy.
+#
+# Parts are encoded as integer columns, one per field that
+# parts_comparison_detail looks at, holding ids for the values that it
+# compares (after the 'Foo' -> 'Foo foo' and middle adjustments), or
+# -1 where it skips the field.  intern maps values to ids and must be
+# shared by the two sides.
+
+PARTS_FIELDS = ((EPITHET_MASK, 0), (TOKEN_MASK, 1), (YEAR_MASK, 2),
+                (GENUS_MASK, 3), (MIDDLE_MASK, 4))
+
+def encode_parts(parts_list, intern):
+  def code(value):
+    c = intern.get(value)
+    if c == None:
+      c = len(intern)
+      intern[value] = c
+    return c
+  columns = [[], [], [], [], []]
+  for p in parts_list:
+    if p.epithet == None:
+      columns[0].append(-1)
+    else:
+      columns[0].append(code(p.genus.lower()
+                             if p.epithet == '' and p.genus
+                             else p.epithet))
+    columns[1].append(-1 if p.token == None else code(p.token))
+    columns[2].append(-1 if p.year == None else code(p.year))
+    columns[3].append(-1 if p.genus == None else code(p.genus))
+    columns[4].append(-1 if p.middle == None else
+                      code(p.epithet if p.middle == '' else p.middle))
+  return [numpy.array(column, dtype=numpy.int64) for column in columns]
+
+# (misses, hits) arrays for pairs (P[I[k]], Q[J[k]]) of encoded parts
+
+def parts_comparison_detail_many(P, Q, I, J):
+  hits = numpy.zeros(len(I), dtype=numpy.int64)
+  misses = numpy.zeros(len(I), dtype=numpy.int64)
+  for (mask, f) in PARTS_FIELDS:
+    a = P[f][I]
+    b = Q[f][J]
+    both = (a >= 0) & (b >= 0)
+    same = a == b
+    hits |= numpy.where(both & same, mask, 0)
+    misses |= numpy.where(both & ~same, mask, 0)
+  return (misses, hits)
+
+# Same decision procedure as classify_comparison_details
+
+def classify_comparison_details_many(misses, hits):
+  mask = YEAR_MASK | TOKEN_MASK
+  genus = (hits & GENUS_MASK) != 0
+  return numpy.select(
+    [(hits & EPITHET_MASK) == 0,
+     (misses & mask) == mask,
+     ((hits & mask) == mask) & genus,
+     (hits & mask) == mask,
+     ((hits & mask) != 0) & genus,
+     (hits & mask) != 0,
+     (misses & mask) == 0],
+    [HETEROTYPIC, HETEROTYPIC, HOMOTYPIC, MOTION,
+     CORRECTION, REVIEW, BINOMIAL],
+    default=REVIEW)
+
+# compare_names_1 for pairs (P[I[k]], Q[J[k]]); returns an array
+
+def compare_names_many(P, Q, I, J):
+  (misses, hits) = parts_comparison_detail_many(P, Q, I, J)
+  return classify_comparison_details_many(misses, hits)
+
 # VERSION > 7
 
 
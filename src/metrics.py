@@ -0,0 +1,128 @@
+# Run metrics: how long each stage took, and how many of things there
+# were.
+#
+#   with metrics.stage("theorize"): ...     wall and CPU time of a stage
+#   metrics.gauge("cross_mrcas", n)         a quantity, last value wins
+#   counts = metrics.counters("report")     a dict of counts, updated
+#                                           by the caller
+#   p = metrics.progress("report", total)   for long loops: p.step()
+#                                           after each item; every
+#                                           PROGRESS_SECONDS a line with
+#                                           rate and ETA goes to stderr
+#
+# Nothing here is subject to util.log's allowance.  write_summary
+# writes everything as JSON (or CSV, if the path ends in .csv), and
+# write_summary_at_exit arranges for that to happen when the program
+# ends, e.g. for a --metrics command line option.
+
+import sys, io, csv, json, time, atexit
+
+PROGRESS_SECONDS = 60
+
+stages = {}                     # name -> {'wall', 'cpu', 'calls'}
+gauges = {}                     # name -> value
+counter_groups = {}             # group -> {name -> count}
+snapshots = {}                  # progress name -> [(seconds, done), ...]
+started = time.time()
+
+class stage:
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    self.wall = time.perf_counter()
+    self.cpu = time.process_time()
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    s = stages.get(self.name)
+    if not s:
+      s = stages[self.name] = {'wall': 0.0, 'cpu': 0.0, 'calls': 0}
+    s['wall'] += time.perf_counter() - self.wall
+    s['cpu'] += time.process_time() - self.cpu
+    s['calls'] += 1
+    return False
+
+def gauge(name, value):
+  gauges[name] = value
+
+def counters(group):
+  counts = counter_groups.get(group)
+  if counts == None:
+    counts = counter_groups[group] = {}
+  return counts
+
+class progress:
+  def __init__(self, name, total=None):
+    self.name = name
+    self.total = total
+    self.done = 0
+    self.start = time.perf_counter()
+    self.next_report = self.start + PROGRESS_SECONDS
+    snapshots[name] = []
+
+  def step(self, n=1):
+    self.done += n
+    now = time.perf_counter()
+    if now >= self.next_report:
+      self.next_report = now + PROGRESS_SECONDS
+      self.snapshot(now)
+
+  def snapshot(self, now):
+    elapsed = now - self.start
+    rate = self.done / elapsed if elapsed > 0 else 0
+    snapshots[self.name].append((round(elapsed, 1), self.done))
+    if self.total and rate > 0:
+      eta = (self.total - self.done) / rate
+      print("# %s: %s of %s, %.0f/s, about %s to go" %
+            (self.name, self.done, self.total, rate, show_seconds(eta)),
+            file=sys.stderr, flush=True)
+    else:
+      print("# %s: %s, %.0f/s" % (self.name, self.done, rate),
+            file=sys.stderr, flush=True)
+
+def show_seconds(seconds):
+  if seconds < 100: return "%.0fs" % seconds
+  if seconds < 6000: return "%.0fm" % (seconds / 60)
+  return "%.1fh" % (seconds / 3600)
+
+# -----------------------------------------------------------------------------
+
+def summary():
+  return {'elapsed': round(time.time() - started, 3),
+          'stages': {name: {'wall': round(s['wall'], 4),
+                            'cpu': round(s['cpu'], 4),
+                            'calls': s['calls']}
+                     for (name, s) in stages.items()},
+          'gauges': dict(gauges),
+          'counters': {group: dict(counts)
+                       for (group, counts) in counter_groups.items()},
+          'progress': dict(snapshots)}
+
+# CSV has columns kind, name, value (one row per stage time, gauge,
+# and count)
+
+def summary_rows(d):
+  yield ("kind", "name", "value")
+  yield ("elapsed", "", d['elapsed'])
+  for (name, s) in d['stages'].items():
+    for what in ('wall', 'cpu', 'calls'):
+      yield ("stage " + what, name, s[what])
+  for (name, value) in d['gauges'].items():
+    yield ("gauge", name, value)
+  for (group, counts) in d['counters'].items():
+    for (name, value) in counts.items():
+      yield ("counter " + group, name, value)
+
+def write_summary(path):
+  d = summary()
+  with io.open(path, 'w') as outport:
+    if path.endswith('.csv'):
+      csv.writer(outport).writerows(summary_rows(d))
+    else:
+      json.dump(d, outport, indent=2)
+      outport.write('\n')
+
+def write_summary_at_exit(path):
+  if path:
+    atexit.register(write_summary, path)
@@ -0,0 +1,106 @@
+# Persistent cache of parsed names (parse.Parts).
+#
+# Parsing a name takes several regex searches, and successive
+# versions of a checklist share nearly all of their names, so parse
+# results are kept in a file from one run to the next.  An entry is
+# keyed by a hash of everything parse_name looks at: the name
+# itself (scientificName, or whatever get_best_name falls back to),
+# the three gnparse columns, canonicalName, and authorship.  The file
+# is tied to VERSION since parsing rules change between versions.
+#
+# checklist.get_parts consults the open cache (if any) before
+# parsing, and checklist.prepare_parts parses all of a checklist's
+# names at once, in a pool of worker processes if asked.
+
+import os, io, pickle, hashlib
+import multiprocessing
+
+import parse
+from util import log, VERSION
+
+the_cache = None                # see open_cache
+
+class NameCache:
+  def __init__(self, path):
+    self.path = path
+    self.parts = {}             # key -> Parts
+    self.dirty = False
+    self.hits = 0
+    self.misses = 0
+    if path and os.path.exists(path):
+      with io.open(path, 'rb') as inport:
+        saved = pickle.load(inport)
+      if saved.get('version') == VERSION:
+        self.parts = saved['parts']
+        log("# %s parsed names from %s" % (len(self.parts), path))
+      else:
+        log("# Discarding names parsed by version %s" % saved.get('version'))
+
+  def get(self, fields):
+    parts = self.parts.get(name_key(fields))
+    if parts:
+      self.hits += 1
+    else:
+      self.misses += 1
+    return parts
+
+  def put(self, fields, parts):
+    self.parts[name_key(fields)] = parts
+    self.dirty = True
+
+  def save(self):
+    if not (self.path and self.dirty): return
+    temp = self.path + ".tmp"
+    with io.open(temp, 'wb') as outport:
+      pickle.dump({'version': VERSION, 'parts': self.parts}, outport,
+                  protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, self.path)
+    self.dirty = False
+    log("# %s parsed names saved to %s (%s hits, %s misses)" %
+        (len(self.parts), self.path, self.hits, self.misses))
+
+def name_key(fields):
+  text = '\x1f'.join(fields)
+  return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+# The cache that get_parts consults.  With no path, parse results are
+# shared across checklists within this run only.
+
+def open_cache(path=None):
+  global the_cache
+  the_cache = NameCache(path)
+  return the_cache
+
+def close_cache():
+  global the_cache
+  if the_cache:
+    the_cache.save()
+  the_cache = None
+
+def lookup(fields):
+  return the_cache.get(fields) if the_cache else None
+
+def remember(fields, parts):
+  if the_cache: the_cache.put(fields, parts)
+
+# fields = (name, gn_full, gn_stem, gn_auth, canonical, authorship)
+
+def parse_fields(fields):
+  (name, gn_full, gn_stem, gn_auth, canonical, authorship) = fields
+  return parse.parse_name(name,
+                          gn_full = gn_full,
+                          gn_stem = gn_stem,
+                          gn_auth = gn_auth,
+                          canonical = canonical,
+                          authorship = authorship)
+
+# Parse many names, in worker processes if jobs > 1.  Results are in
+# the same order as the input.
+
+def parse_many(fields_list, jobs=1):
+  if jobs > 1 and len(fields_list) > 1000:
+    chunk = min(5000, len(fields_list) // (jobs * 4) + 1)
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+      return pool.map(parse_fields, fields_list, chunksize=chunk)
+  else:
+    return [parse_fields(fields) for fields in fields_list]
@@ -6,7 +6,8 @@
  extends the scientific name) into the taxon record.
 
  python3 ncbi_to_dwc.py from >to
-   'from' is a directory containing .dmp files from ncbi
+   'from' is a taxdmp .zip file from ncbi, or a directory containing
+   the .dmp files from one
    DwC file is written to standard output (in CSV format with header row)
 
  E.g.
@@ -15,17 +16,46 @@
  Copied from ../cldiff/src/ncbi_to_dwc.py on 2021-08-24
 """
 
-import sys, os, csv, argparse, regex as re
+import sys, os, io, csv, zipfile, argparse, regex as re
 
 from util import stable_hash
 
-def ncbi_to_dwc(indir, outfile):
-  assert os.path.exists(indir)
-  accepteds = read_accepteds(os.path.join(indir, "nodes.dmp"))
-  names = read_names(os.path.join(indir, "names.dmp"))
-  merged = read_merged(os.path.join(indir, "merged.dmp"))
-  (synonyms, scinames, authorities) = collate_names(names, accepteds)
-  emit_dwc(accepteds, synonyms, scinames, authorities, merged, outfile)
+# taxdump is a directory containing the .dmp files, or the taxdmp .zip
+# file itself.  Only the nodes are held in memory; names.dmp is
+# read twice, first for the canonical and scientific names of the
+# nodes, then for the synonyms.
+
+def ncbi_to_dwc(taxdump, outfile):
+  assert os.path.exists(taxdump)
+  accepteds = read_accepteds(dump_rows(taxdump, "nodes.dmp"))
+  (scinames, authorities) = read_node_names(dump_rows(taxdump, "names.dmp"))
+  writer = csv.writer(outfile)
+  emit_header(writer)
+  emit_accepteds(writer, accepteds, scinames, authorities)
+  del accepteds
+  emit_synonyms(writer,
+                generate_synonyms(dump_rows(taxdump, "names.dmp"),
+                                  scinames, authorities))
+  emit_merged(writer, read_merged(dump_rows(taxdump, "merged.dmp")))
+
+# Rows of a .dmp file.  Lines look like
+#   1\t|\t1\t|\tno rank\t|\t...\t|\n
+# so splitting on \t|\t gets the fields without the | separators.
+
+def dump_rows(taxdump, name):
+  if zipfile.is_zipfile(taxdump):
+    with zipfile.ZipFile(taxdump) as z:
+      with z.open(name) as binary:
+        yield from split_rows(io.TextIOWrapper(binary, encoding='utf-8'))
+  else:
+    with open(os.path.join(taxdump, name), "r") as infile:
+      yield from split_rows(infile)
+
+def split_rows(infile):
+  for line in infile:
+    if line.endswith("\t|\n"):
+      line = line[:-3]
+    yield line.split("\t|\t")
 
 def write_row(writer,
               taxonID, ncbi_id, parentNameUsageID, taxonRank,
@@ -35,13 +65,15 @@ def write_row(writer,
                    acceptedNameUsageID, scientificName, canonicalName,
                    taxonomicStatus, nomenclaturalStatus])
 
-def emit_dwc(accepteds, synonyms, scinames, authorities, merged, outfile):
-  writer = csv.writer(outfile)
+def emit_header(writer):
   write_row(writer,
             "taxonID", "managed_id", "parentNameUsageID", "taxonRank",
             "acceptedNameUsageID", "scientificName", "canonicalName",
             "taxonomicStatus", "nomenclaturalStatus")
-  # Accepted names
+
+# Accepted names
+
+def emit_accepteds(writer, accepteds, scinames, authorities):
   for (taxid, parent_id, rank) in accepteds:
     sci = scinames.get(taxid, None)
     can = authorities.get(taxid, None)
@@ -49,7 +81,10 @@ def emit_dwc(accepteds, synonyms, scinames, authorities, merged, outfile):
               taxid, managed_id(taxid), parent_id, clean_rank(rank, can),
               None, sci, can,
               "accepted", None)
-  # Synonyms.  taxonID is the id of the synonym; taxid of the accepted
+
+# Synonyms.  taxonID is the id of the synonym; taxid of the accepted
+
+def emit_synonyms(writer, synonyms):
   for (taxid, text, kind, spin) in synonyms:
     # synonym is a taxonomic status, not a nomenclatural status
     if kind == "synonym": kind = None
@@ -67,6 +102,8 @@ def emit_dwc(accepteds, synonyms, scinames, authorities, merged, outfile):
                 taxonID, None, None, clean_rank(rank, can),
                 taxid, None, can,
                 "synonym", kind)
+
+def emit_merged(writer, merged):
   for (old_id, new_id) in merged:
     can = "deprecated taxon that had taxid %s" % old_id
     write_row(writer,
@@ -77,106 +114,85 @@ def emit_dwc(accepteds, synonyms, scinames, authorities, merged, outfile):
 def managed_id(taxid):
   return "ncbi:%s" % taxid
 
-# Input: list of (id, text, kind, spin) from names.txt file
-# Output: list of (id, text, kind, spin); 
-#         dict: id -> text [canonical names];
-#         dict: id -> text [authorities]
-
-def collate_names(names, accepteds):
-  keep = []
+# names.dmp rows, one group per tax_id:
+# 	0 tax_id					-- the id of node associated with this name
+# 	1 name_txt				-- name itself
+# 	2 unique name  		-- the unique variant of this name if name not unique
+# 	3 name class			-- (synonym, common name, ...)
+
+def name_groups(rows):
+  group = []
+  for row in rows:
+    if group and row[0] != group[0][0]:
+      yield group
+      group = []
+    group.append(row)
+  if group:
+    yield group
+
+# Returns dict: id -> text [canonical names], dict: id -> text [authorities]
+
+def read_node_names(rows):
   scinames = {}
-  for row in names:
-    (id, text, kind, _) = row
-    if kind == "scientific name":
-      scinames[id] = text
-    else:
-      keep.append(row)
-  # Remove the canonical names, keep the rest
-  names2 = keep
-  keep = None #GC
+  authorities = {}
+  for group in name_groups(rows):
+    for row in group:
+      if row[3] == "scientific name":
+        scinames[row[0]] = row[1]
+    for row in group:
+      if row[3] == "authority":
+        probe = scinames.get(row[0], None)
+        if probe and row[1].startswith(probe):
+          authorities[row[0]] = row[1]
   print ("# %s canonicalNames (NCBI calls them 'scientific names')" %
          len(scinames),
          file=sys.stderr)
-  synonyms = []
-  authorities = {}
-  for row in names2:
-    (id, text, kind, _) = row
-    if kind == "authority":
-      probe = scinames.get(id, None)
-      if probe and text.startswith(probe):
-        authorities[id] = text
-      else:
-        synonyms.append(row)
-    else:
-      synonyms.append(row)
-  # Remove authorities (= scientific names), keep the rest
   print ("# %s scientificNames (NCBI calls them 'authorities')" %
          len(authorities),
          file=sys.stderr)
-  return (synonyms, scinames, authorities)
-
-def read_accepteds(nodes_path):
+  return (scinames, authorities)
+
+# Yields (id, text, kind, spin) for names other than the canonical
+# and scientific names of nodes.  spin distinguishes the names of a
+# node from one another.
+
+def generate_synonyms(rows, scinames, authorities):
+  count = 0
+  for group in name_groups(rows):
+    seen = set()
+    for (id, name, unique, kind) in group:
+      if (name, kind, unique) in seen:
+        # 263 of these in 2020-08-01
+        continue
+      seen.add((name, kind, unique))
+      count += 1
+      if kind == "scientific name":
+        continue
+      if kind == "authority":
+        probe = scinames.get(id, None)
+        if probe and name.startswith(probe):
+          continue
+      yield (id, name, kind, stable_hash((name, kind, unique)))
+  print ("# %s names" % count, file=sys.stderr)
+
+def read_accepteds(rows):
   accepteds = []
-  # Read the nodes file
-  with open(nodes_path, "r") as infile:
-    for row in csv.reader(infile,
-                          delimiter="\t",
-                          quotechar="\a",
-                          quoting=csv.QUOTE_NONE):
-      # tax_id, |, parent tax_id, |, rank, ... other stuff we don't use ...
-      rank = row[4]
-      if rank == "clade" or rank == "no rank":
-        rank = None
-      accepteds.append((row[0], row[2], rank)) # id, superior id, rank
+  for row in rows:
+    # tax_id, parent tax_id, rank, ... other stuff we don't use ...
+    rank = row[2]
+    if rank == "clade" or rank == "no rank":
+      rank = None
+    accepteds.append((row[0], row[1], rank)) # id, superior id, rank
   print ("# %s accepted names" % len(accepteds), file=sys.stderr)
   return accepteds
 
-def read_names(names_path):
-  names = []
-  # Read the names file
-  with open(names_path, "r") as infile:
-    # Depends on names being grouped by taxa
-    previous_id = None
-    spins = {}
-    for row in csv.reader(infile,
-                          delimiter="\t",
-                          quotechar="\a",
-                          quoting=csv.QUOTE_NONE):
-      # 0	tax_id					-- the id of node associated with this name
-	    # 2 name_txt				-- name itself
-	    # 4 unique name  		-- the unique variant of this name if name not unique
-	    # 6 name class			-- (synonym, common name, ...)
-      id = row[0]
-      if str(id) != previous_id:
-        previous_id = id
-        spins = {}
-      name = row[2]
-      unique = row[4]
-      nom_status = row[6]
-      spin = stable_hash((name, nom_status, unique))
-      out = (id, name, nom_status, spin)
-      if not spin in spins:
-        names.append(out)
-        spins[spin] = True
-      else:
-        # 263 of these in 2020-08-01
-        # print("# Ignoring redundant name record %s" % (out,), file=sys.stderr)
-        pass
-  print ("# %s names" % len(names), file=sys.stderr)
-  return names
-
-def read_merged(merged_path):
-  merged = []
-  # Read the merged file
-  with open(merged_path, "r") as infile:
-    for row in csv.reader(infile,
-                          delimiter="\t",
-                          quotechar="\a",
-                          quoting=csv.QUOTE_NONE):
-      # old_tax_id, |, new_tax_id
-      merged.append((row[0], row[2]))
-  print ("# %s merged taxa" % len(merged), file=sys.stderr)
-  return merged
+def read_merged(rows):
+  count = 0
+  for row in rows:
+    # old_tax_id, new_tax_id
+    yield (row[0], row[1])
+    count += 1
+  print ("# %s merged taxa" % count, file=sys.stderr)
 
 def clean_rank(rank, can):
   if not rank:
@@ -203,6 +219,6 @@ binomial_re = re.compile('\p{Uppercase_Letter}\p{Lowercase_Letter}+ \p{Lowercase
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(prog='ncbi_to_dwc',
                                    description="Writes a CSV file in Darwin Core form to standard output")
-  parser.add_argument('taxdump', help='directory containing NCBI dump i.e. names.txt, merged.txt, and so on')
+  parser.add_argument('taxdump', help='NCBI taxdmp .zip file, or directory containing the unzipped dump i.e. names.dmp, merged.dmp, and so on')
   args = parser.parse_args()
   ncbi_to_dwc(args.taxdump, sys.stdout)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import sys
+from array import array
 from typing import NamedTuple, Any
 from collections import namedtuple
 from util import log
@@ -19,6 +20,7 @@ AMBIENT=None
 class Plan(NamedTuple):
   propid_to_pos: Any
   props: Any
+  accessors: Any                # compiled getters, see compiled_getter
 
 def make_plan_from_header(header):
   #log("%s" % (header,))
@@ -32,7 +34,7 @@ def make_plan(props):
   propid_to_pos = [None] * _global_property_counter
   for (prop, pos) in zip(props, range(len(props))):
     propid_to_pos[prop.id] = pos
-  return Plan(propid_to_pos, props)
+  return Plan(propid_to_pos, props, {})
 
 # ----- Properties
 
@@ -64,6 +66,11 @@ def declare_property(label, filler=None, getter=None, setter=None,
     log("# Creating another instantiation of property '%s'" % label)
   return Property(id, label, filler, getter, setter, inherit)
 
+def propid_label(id):           # inverse of declare_property's numbering
+  for (label, i) in _label_to_propid.items():
+    if i == id: return label
+  return None
+
 # You can explicitly pass context=AMBIENT to get ambient context.
 
 def get_set(prop, context=AMBIENT):
@@ -75,6 +82,8 @@ def getter(prop, context=AMBIENT):
     return contextual_getter(prop, context)
   elif prop.getter:
     return prop.getter
+  elif COMPILED:
+    return compiled_getter(prop)
   else:
     return ambient_getter(prop)
 
@@ -109,6 +118,67 @@ def ambient_getter(prop):
     return val
   return getit
 
+# Plan-compiled getters.  ambient_getter works out on every call where
+# in the record the value lives.  A compiled getter instead keeps, in
+# each plan it encounters, an accessor specialized to that plan: if
+# the plan has a column for the property, the accessor is a single
+# indexed load; otherwise it goes straight to `lookedup` and then to
+# `cloned_from`.  Anything unusual (missing value, filler, shadow)
+# drops through to the generic ambient getter.
+
+COMPILED = True
+_accessor_slot_counter = 0
+
+def compiled_getter(prop):
+  global _accessor_slot_counter
+  slot = _accessor_slot_counter  # this getter's key in plan.accessors
+  _accessor_slot_counter += 1
+  slow = ambient_getter(prop)
+  def getit(x, default=_NODEFAULT):
+    accessors = x.plan.accessors
+    acc = accessors.get(slot)
+    if acc == None:
+      acc = compile_accessor(x.plan, prop, getit, slow)
+      accessors[slot] = acc
+    return acc(x, default)
+  return getit
+
+def compile_accessor(plan, prop, getit, slow):
+  if prop.id < len(plan.propid_to_pos):
+    pos = plan.propid_to_pos[prop.id]
+  else:
+    pos = None
+  if pos != None:
+    def at_position(x, default=_NODEFAULT):
+      row = x.positional
+      if row.__class__ is StoredRow:
+        column = row.store.columns[pos]
+        if column.__class__ is list:
+          stored = column[row.index]
+        else:
+          stored = row.store.get(pos, row.index)
+      else:
+        stored = row[pos]
+      if stored == MISSING or stored is _SHADOW or stored is _CYCLING:
+        return slow(x, default)
+      return stored
+    return at_position
+  id = prop.id
+  filler = prop.filler
+  inherit = prop.inherit and not filler
+  def looked_up(x, default=_NODEFAULT):
+    stored = x.lookedup.get(id, MISSING)
+    if stored == MISSING:
+      if inherit and x.cloned_from:
+        return getit(x.cloned_from, default)
+      if filler or default is _NODEFAULT:
+        return slow(x, default)
+      return default
+    if stored is _SHADOW or stored is _CYCLING:
+      return slow(x, default)
+    return stored
+  return looked_up
+
 def setter(prop, context=AMBIENT):
   if context:
     return contextual_setter(prop, context)
@@ -136,6 +206,7 @@ def ambient_setter(prop):
 
 def contextual_getter(prop, context):
   column_mep = _get_column_mep(prop, context)
+  outer = getter(prop)                  # made once: each getter gets a slot
   def getit(inst, default=_NODEFAULT):
     stored = mep_get(column_mep, inst, MISSING)
     if stored == MISSING:
@@ -144,7 +215,7 @@ def contextual_getter(prop, context):
       elif prop.filler:
         assert not "TBD"
       else:
-        val = getter(prop)(inst)      # Inherit from outer context
+        val = outer(inst)             # Inherit from outer context
     else:
       val = stored
     return val
@@ -244,7 +315,7 @@ def construct(plan, row):
 def clone(inst):
   global _global_record_counter
   cloned = Record(_global_record_counter,
-                    empty_plan, [], {}, inst)
+                    empty_plan, (), {}, inst)   # no fields of its own
   _global_record_counter += 1
   return cloned
   
@@ -252,6 +323,155 @@ empty_plan = make_plan(())
 
 _global_record_counter = 0
 
+# ----- Column stores
+
+# Struct-of-arrays alternative to giving every record its own list of
+# field values.  A Store holds one list per column for all the rows of
+# a table (e.g. one Source), and a record's `positional` becomes a
+# small view onto its row, so getters and setters work unchanged.
+#
+# String values are interned through a per-column pool while loading,
+# so the genus, rank, status, and authorship strings that are repeated
+# across millions of rows are stored only once.  Columns whose values
+# turn out to be mostly distinct (taxonIDs) stop being pooled.
+#
+# Columns for int_props (e.g. numeric taxonIDs) are stored as machine
+# integers as long as every value round-trips through int(); the
+# first value that doesn't (say '00123' or 'gbif:5') turns the column
+# back into a list of strings.
+
+_INT_MISSING = -(1 << 63)      # MISSING in an int column
+_POOL_PROBE = 10000            # rows to see before judging a pool
+
+class Store:
+  def __init__(self, plan, int_props=()):
+    int_ids = set(prop.id for prop in int_props)
+    self.plan = plan
+    self.count = 0
+    self.columns = []
+    self.pools = []
+    for prop in plan.props:
+      if prop.id in int_ids:
+        self.columns.append(array('q'))
+        self.pools.append(None)
+      else:
+        self.columns.append([])
+        self.pools.append({})
+
+  def append(self, row):
+    if len(row) != len(self.plan.props):
+      print("** WNA: have %s args, expect %s" %
+            (len(row),
+             [prop.label for prop in self.plan.props]),
+            file=sys.stderr)
+      assert False
+    i = self.count
+    for (pos, column, pool, val) in \
+        zip(range(len(row)), self.columns, self.pools, row):
+      if pool != None:
+        val = pool.setdefault(val, val)
+      if isinstance(column, array):
+        n = _encode_int(val)
+        if n == None:
+          column = self._demote(pos)
+          column.append(val)
+        else:
+          column.append(n)
+      else:
+        column.append(val)
+    self.count += 1
+    if self.count == _POOL_PROBE:
+      # A pool that is as big as its column is just wasted space
+      for pos in range(len(self.pools)):
+        pool = self.pools[pos]
+        if pool != None and len(pool) > _POOL_PROBE // 2:
+          self.pools[pos] = None
+    return i
+
+  def get(self, pos, i):
+    column = self.columns[pos]
+    if isinstance(column, array):
+      n = column[i]
+      return MISSING if n == _INT_MISSING else str(n)
+    return column[i]
+
+  def put(self, pos, i, val):
+    column = self.columns[pos]
+    if isinstance(column, array):
+      n = _encode_int(val)
+      if n != None:
+        column[i] = n
+        return
+      column = self._demote(pos)
+    column[i] = val
+
+  # Loading is over; forget the pools (the interned strings stay
+  # shared by the rows that use them)
+  def seal(self):
+    self.pools = [None] * len(self.pools)
+
+  def _demote(self, pos):
+    column = self.columns[pos]
+    strings = [MISSING if n == _INT_MISSING else str(n) for n in column]
+    self.columns[pos] = strings
+    return strings
+
+def _encode_int(val):
+  if val == MISSING: return _INT_MISSING
+  if not isinstance(val, str): return None
+  try:
+    n = int(val)
+  except ValueError:
+    return None
+  if str(n) != val or not (_INT_MISSING < n < (1 << 63)):
+    return None
+  return n
+
+# A record's positional fields, living in a Store
+
+class StoredRow:
+  __slots__ = ('store', 'index')
+  def __init__(self, store, index):
+    self.store = store
+    self.index = index
+  def __getitem__(self, pos):
+    return self.store.get(pos, self.index)
+  def __setitem__(self, pos, val):
+    self.store.put(pos, self.index, val)
+  def __len__(self):
+    return len(self.store.columns)
+  def __iter__(self):
+    return (self.store.get(pos, self.index)
+            for pos in range(len(self.store.columns)))
+
+def make_store(plan, int_props=()):
+  return Store(plan, int_props)
+
+# Rebuild a sealed store from columns saved earlier (see snapshot.py)
+
+def restore_store(plan, columns, count):
+  assert len(columns) == len(plan.props)
+  store = Store(plan)
+  store.columns = columns
+  store.count = count
+  store.seal()
+  return store
+
+# Like construct, but the row's values go into the store
+
+def construct_in(store, row):
+  return construct_stored(store, store.append(row))
+
+def construct_stored(store, i):     # record for row i of store
+  global _global_record_counter
+  record = Record(_global_record_counter,
+                  store.plan,
+                  StoredRow(store, i),
+                  {},
+                  None)
+  _global_record_counter += 1
+  return record
+
 
 # Maps keyed by record
 
@@ -326,4 +546,24 @@ if __name__ == '__main__':
   set_a(x, None)
   expect('set q.a None', get_a(q), None)
 
+  tid = declare_property('tid')
+  store = make_store(make_plan_from_header(['tid', 'a', 'b']),
+                     int_props=(tid,))
+  get_tid = getter(tid)
+  s1 = construct_in(store, ['17', 'genus', 'x'])
+  s2 = construct_in(store, ['', 'genus', 'y'])
+  expect('stored int', get_tid(s1), '17')
+  expect('stored missing int', get_tid(s2, 'none'), 'none')
+  expect('pooled', get_a(s1) is get_a(s2), True)
+  expect('is array', isinstance(store.columns[0], array), True)
+  set_a(s2, 'species')
+  expect('stored set', (get_a(s1), get_a(s2)), ('genus', 'species'))
+  s3 = construct_in(store, ['0017', 'genus', 'z'])
+  expect('demoted', isinstance(store.columns[0], array), False)
+  expect('demoted values', [get_tid(s, '-') for s in (s1, s2, s3)],
+         ['17', '-', '0017'])
+  set_m(s3, 'looked up')
+  expect('stored lookedup', get_m(s3), 'looked up')
+  expect('stored row', list(s1.positional), ['17', 'genus', 'x'])
+
   print("Failed %s tests" % failed)
@@ -3,7 +3,7 @@ import math
 from util import log, MISSING
 
 from checklist import get_superior, get_rank, get_canonical, blorb
-from simple import mrca
+from simple import mrca, get_ancestor_of_rank
 #from parse import get_family
 
 # Are x and y near enough that y might be a genus change of x or
@@ -28,13 +28,10 @@ def near_enough(x, y):          # In same or different checklists
 #  (families Muridae, Cercopithecidae)
 
 def get_family(x):              # returns canonical name
-  while get_rank(x, None) != 'family':
-    sup = get_superior(x, None)
-    if sup == None:
-      # log("# No sup: %s %s" % (get_primary_key(x), blorb(x)))
-      return None
-    x = sup.record
-  return get_canonical(x, None)
+  f = get_ancestor_of_rank(x, 'family')
+  if f == None:
+    return None
+  return get_canonical(f, None)
 
 
 
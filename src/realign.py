@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# Incremental re-alignment of A against a new version B' of B.
+#
+# Matching records across checklists (typify.find_typicals) is most
+# of the cost of a run, and a new release of a checklist usually
+# changes only a few percent of its rows.  So instead of finding
+# exemplars afresh, we diff B and B' by taxonID and row fingerprint
+# (util.stable_hash), keep the previous run's exemplars wherever no
+# record involved has changed, and rematch only the subproblems whose
+# epithet keys touch changed rows.  Blocks, cross-MRCAs and estimates
+# are then computed (in linear passes) and the report is written as
+# align.py would.
+
+import sys, argparse
+import util, rows, snapshot, theory, align, exemplar, name_cache, metrics
+
+from util import log, windex
+from checklist import rows_to_checklist, look_up_record
+from workspace import make_workspace, prepare_workspace_parts
+from exemplar import record_subproblem_key, apply_exemplars, \
+  find_subproblems, write_exemplar_list
+from typify import find_endohomotypics, find_typicals
+from estimate import find_estimates
+
+# -----------------------------------------------------------------------------
+# Fingerprints: taxonID -> hash of row
+
+def ingest_fingerprinted(row_iterable, meta):
+  prints = {}
+  if isinstance(row_iterable, snapshot.Snapshot):
+    for row in fingerprinting(row_iterable, prints): pass
+    C = rows_to_checklist(row_iterable, meta)
+  else:
+    C = rows_to_checklist(fingerprinting(row_iterable, prints), meta)
+  return (C, prints)
+
+def fingerprinting(row_iterable, prints):
+  row_iterator = iter(row_iterable)
+  header = next(row_iterator)
+  yield header
+  pk_col = windex(header, "taxonID")
+  for row in row_iterator:
+    prints[row[pk_col]] = util.stable_hash(list(map(str, row)))
+    yield row
+
+# taxonIDs of rows that were added, removed, or changed
+
+def diff_fingerprints(old, new):
+  removed = [key for key in old if not key in new]
+  added = [key for key in new if not key in old]
+  changed = [key for (key, fp) in new.items()
+             if key in old and old[key] != fp]
+  log("* %s rows added, %s removed, %s changed" %
+      (len(added), len(removed), len(changed)))
+  return set(removed) | set(added) | set(changed)
+
+# -----------------------------------------------------------------------------
+# Exemplars
+
+# Subproblem keys of changed rows, in either version of B
+
+def touched_keys(B_old, B_new, changed):
+  keys = set()
+  for taxonid in changed:
+    for C in (B_old, B_new):
+      x = look_up_record(C, taxonid)
+      if x: keys.add(record_subproblem_key(x))
+  return keys
+
+# Read previous exemplars: sid -> [(which, taxonID), ...]
+
+def read_exemplar_groups(in_rows):
+  the_rows = iter(in_rows.rows())
+  header = next(the_rows)
+  sid_col = windex(header, "exemplar id")
+  which_col = windex(header, "checklist")
+  taxonid_col = windex(header, "taxonID")
+  groups = {}
+  for row in the_rows:
+    groups.setdefault(int(row[sid_col]), []).append((row[which_col],
+                                                     row[taxonid_col]))
+  return groups
+
+# An exemplar is kept if none of its records has changed or has a
+# touched key.  Dropping an exemplar touches the keys of its records,
+# so this is repeated until nothing more is dropped.
+
+def keep_exemplars(AB, groups, changed, keys):
+  member_keys = {}
+  for (sid, members) in groups.items():
+    mkeys = []
+    for (which, taxonid) in members:
+      x = look_up_record(AB.A if which == 'A' else AB.B, taxonid)
+      if not x or (which == 'B' and taxonid in changed):
+        mkeys = None
+        break
+      mkeys.append(record_subproblem_key(x))
+    member_keys[sid] = mkeys
+  kept = set(groups)
+  while True:
+    dropped = [sid for sid in kept
+               if member_keys[sid] == None or
+                  any(key in keys for key in member_keys[sid])]
+    if not dropped: break
+    for sid in dropped:
+      kept.remove(sid)
+      keys.update(member_keys[sid] or ())
+  log("* Keeping %s of %s exemplars; %s subproblem keys to redo" %
+      (len(kept), len(groups), len(keys)))
+  return kept
+
+def find_exemplars_incrementally(AB, groups, changed, keys, jobs=1):
+  kept = keep_exemplars(AB, groups, changed, keys)
+  apply_exemplars(AB, ((sid, which, taxonid)
+                       for sid in sorted(kept)
+                       for (which, taxonid) in groups[sid]))
+  find_endohomotypics(AB)
+  subprobs = find_subproblems(AB)
+  redo = {key: subprobs[key] for key in subprobs if key in keys}
+  log("* Rematching %s of %s subproblems" % (len(redo), len(subprobs)))
+  find_typicals(AB, redo, None, True, jobs=jobs)
+  exemplar.report_on_exemplars(AB)
+
+# -----------------------------------------------------------------------------
+
+# Compare new report with previous one, for the log
+
+def report_changes(new_rows, old_path):
+  with rows.open(old_path) as old_rows:
+    old = set(map(tuple, old_rows.rows()))
+  new = set(map(tuple, new_rows))
+  log("* Report: %s rows as before, %s new or changed, %s gone" %
+      (len(new & old), len(new - old), len(old - new)))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="""
+    Align A with a new version of B, reusing the exemplars found when
+    A was aligned with the previous version.  Writes the alignment
+    report to standard output.
+    """)
+  parser.add_argument('--A', help="the A checklist, as path name")
+  parser.add_argument('--B', help="the previous version of B, as path name")
+  parser.add_argument('--new', help="the new version of B, as path name")
+  parser.add_argument('--exemplars',
+                      help="exemplars found for A and the previous B")
+  parser.add_argument('--report', default=None,
+                      help="previous alignment report (to summarize changes)")
+  parser.add_argument('--exemplars-out', dest='exemplars_out', default=None,
+                      help="where to write exemplars for A and the new B")
+  parser.add_argument('--Aname', help="short name of the A checklist",
+                      default='A')
+  parser.add_argument('--Bname', help="short name of the B checklist",
+                      default='B')
+  parser.add_argument('--jobs', type=int, default=1,
+                      help="""number of processes for parsing names, matching,
+                              and generating the report""")
+  parser.add_argument('--metrics', default=None,
+                      help="where to write run metrics (JSON, or CSV if path ends in .csv)")
+  args=parser.parse_args()
+  metrics.write_summary_at_exit(args.metrics)
+
+  log("* Realigning")
+  with rows.open(args.A) as a_rows:
+    A = rows_to_checklist(a_rows.rows(), {'tag': args.Aname})
+  with rows.open(args.B) as b_rows:
+    (B_old, old_prints) = ingest_fingerprinted(b_rows.rows(),
+                                               {'tag': args.Bname})
+  with rows.open(args.new) as b_rows:
+    (B_new, new_prints) = ingest_fingerprinted(b_rows.rows(),
+                                               {'tag': args.Bname})
+  changed = diff_fingerprints(old_prints, new_prints)
+  keys = touched_keys(B_old, B_new, changed)
+  del B_old
+
+  AB = make_workspace(A, B_new, {'tag': "AB"})
+  if args.jobs > 1:
+    name_cache.open_cache()
+    prepare_workspace_parts(AB, args.jobs)
+  with rows.open(args.exemplars) as e_rows:
+    groups = read_exemplar_groups(e_rows)
+  with metrics.stage("exemplars"):
+    find_exemplars_incrementally(AB, groups, changed, keys, jobs=args.jobs)
+  if args.exemplars_out:
+    with open(args.exemplars_out, 'w') as outport:
+      write_exemplar_list(AB, outport)
+
+  theory.theorize(AB, False)
+  with metrics.stage("estimates"):
+    find_estimates(AB)
+  with metrics.stage("report"):
+    report = list(align.generate_plugin_report(AB, jobs=args.jobs))
+  util.write_rows(report, sys.stdout)
+  if args.report:
+    report_changes(report, args.report)
+  log("* Wrote alignment\n")
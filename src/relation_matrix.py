@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# All-pairs RCC-5 relations between chosen A records and chosen B
+# records, e.g. every genus in A against every genus in B, written as
+# a CSV matrix with one row per A record and one column per B record.
+
+import sys, csv, argparse
+import rows, theory, exemplar
+
+from util import log
+from rcc5 import rcc5_symbol
+from checklist import all_records, look_up_record, is_accepted, get_rank, \
+  get_primary_key, get_canonical
+from workspace import ingest_workspace
+
+# Records of C given by taxonID, or else all accepted records of rank
+
+def choose_records(C, rank, ids):
+  if ids:
+    chosen = []
+    for taxonid in ids.split(','):
+      x = look_up_record(C, taxonid)
+      if x: chosen.append(x)
+      else: log("# No such record: %s" % taxonid)
+    return chosen
+  return [x for x in all_records(C)
+          if is_accepted(x) and get_rank(x, None) == rank]
+
+def generate_matrix(AB, xs, ys):
+  us = [AB.in_left(x) for x in xs]
+  vs = [AB.in_right(y) for y in ys]
+  log("* Comparing %s A records with %s B records" % (len(us), len(vs)))
+  matrix = theory.compare_many(AB, us, vs)
+  yield (["A taxon id", "A taxon name"] +
+         [get_primary_key(y) for y in ys])
+  for (x, row) in zip(xs, matrix):
+    yield ([get_primary_key(x), get_canonical(x, None)] +
+           [rcc5_symbol(pred.relation) for pred in row])
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="""
+    Write the RCC-5 relations between A records and B records as a
+    CSV matrix: one row per A record, one column (headed by taxonID)
+    per B record.
+    """)
+  parser.add_argument('--A', help="the A checklist, as path name or -",
+                      default='-')
+  parser.add_argument('--B', help="the B checklist, as path name or -",
+                      default='-')
+  parser.add_argument('--exemplars', help="the exemplars table, as path name",
+                      default=None)
+  parser.add_argument('--Aname', help="short name of the A checklist",
+                      default='A')
+  parser.add_argument('--Bname', help="short name of the B checklist",
+                      default='B')
+  parser.add_argument('--rank', default='genus',
+                      help="compare all accepted records of this rank")
+  parser.add_argument('--Aids', default=None,
+                      help="compare these A records (comma separated taxonIDs)")
+  parser.add_argument('--Bids', default=None,
+                      help="compare these B records (comma separated taxonIDs)")
+  args=parser.parse_args()
+  with rows.open(args.A) as a_rows:
+    with rows.open(args.B) as b_rows:
+      AB = ingest_workspace(a_rows.rows(), b_rows.rows(),
+                            A_name=args.Aname, B_name=args.Bname)
+  if args.exemplars:
+    with rows.open(args.exemplars) as e_rows:
+      exemplar.read_exemplars(e_rows, AB)
+  else:
+    exemplar.find_exemplars(AB)
+  theory.theorize(AB, False)
+  xs = choose_records(AB.A, args.rank, args.Aids)
+  ys = choose_records(AB.B, args.rank, args.Bids)
+  writer = csv.writer(sys.stdout)
+  for row in generate_matrix(AB, xs, ys):
+    writer.writerow(row)
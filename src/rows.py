@@ -5,7 +5,7 @@
 # Very poor design here - my first attempt to do smoething like this,
 # and it came out wrong.  Really needs to be thought through afresh.
 
-import sys, io, csv, newick
+import sys, os, io, csv, newick, compressed, dwca
 
 # For CoL
 csv.field_size_limit(131072 * 4)
@@ -14,9 +14,24 @@ def open(specifier, mode='r'):
   if not specifier: specifier = '-'
   return Rows(specifier, mode)
 
+# Binary checklist snapshots (see snapshot.py) start with this
+
+SNAPSHOT_MAGIC = b"listtools snapshot\n"
+
+def is_snapshot_file(path):
+  if not os.path.isfile(path):  # don't consume a pipe's bytes
+    return False
+  try:
+    with io.open(path, 'rb') as inport:
+      return inport.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+  except OSError:
+    return False
+
 class Rows:
   def __init__(self, x, mode): 
     self.x = x                  # path or -
+    self.snapshot = False
+    self.archive = False
 
     if x.startswith('('):
       self.file = None
@@ -27,8 +42,15 @@ class Rows:
         self.file = sys.stdout if 'w' in mode else sys.stdin
       else:
         self.close_required = True
-        # I fear that this is nonsensical !
-        self.file = io.open(x, mode)
+        if not 'w' in mode and is_snapshot_file(x):
+          self.snapshot = True
+          self.file = io.open(x, 'rb')
+        elif not 'w' in mode and dwca.is_archive(x):
+          self.archive = True     # DwC-A .zip; see dwca.py
+          self.file = dwca.open_archive(x)
+        else:
+          # I fear that this is nonsensical !
+          self.file = compressed.open_file(x, mode)
     self.open = True
 
   def __enter__(self):
@@ -41,11 +63,17 @@ class Rows:
       self.file.__exit__(exc_type, exc_val, exc_tb)
     self.open = False
 
-  def rows(self):             # returns a row generator
-    if self.file:
-      yield from csv.reader(self.file)
+  def rows(self):             # returns a row iterable
+    if self.snapshot:
+      # Already ingested; see snapshot.py
+      import snapshot
+      return snapshot.read_snapshot(self.file)
+    elif self.archive:
+      return dwca.archive_rows(self.file)
+    elif self.file:
+      return csv.reader(self.file)
     else:
-      yield from newick.parse_newick(self.x)
+      return newick.parse_newick(self.x)
 
   def write_rows(self, row_generator):
     assert self.file
@@ -1,3 +1,4 @@
+from array import array
 from util import VERSION
 import property as prop
 from checklist import *
@@ -68,8 +69,8 @@ def compare_per_checklist_older(x, y):
   # older version, matching 1/23/26 version of mss
   if x is y:
     return predicate(EQ, y) # x = peer = y
-  (x_peer, y_peer) = find_peers(x, y)
-  if x_peer is y_peer:     # x <= x_peer = y_peer >= y
+  x_peer = y_peer = which_above(x, y)
+  if x_peer:               # x <= x_peer = y_peer >= y
     # They intersect, so < = >
     if x_peer is x:          # x = x_peer >= y, so x >= y (or > y, so x > y)
       y_sup = get_superior(y)
@@ -94,7 +95,19 @@ def compare_per_checklist_older(x, y):
       return predicate(NOINFO, y, note="synonym ? sibling")
     return predicate(DISJOINT, y, note="x < xsup = ysup > y")
 
+# Returns ancestors of x and y at the same level.  If x and y are
+# covered by their source's hierarchy index, only whether the peers
+# coincide is needed by callers, and that is an interval test.
+
 def find_peers(x, y):
+  H = get_hierarchy(x, y)
+  if H:
+    i = hierarchy_position(H, x)
+    j = hierarchy_position(H, y)
+    if i != None and j != None:
+      if i <= j <= H.end[i]: return (x, x)    # x >= y
+      if j <= i <= H.end[j]: return (y, y)    # x <= y
+      # Not comparable; climb only as far as needed for the peers
   assert get_level(x, None) and get_level(x, None), "no levels"
   i = min(get_level(x), get_level(y))
   while get_level(x) > i:
@@ -103,10 +116,31 @@ def find_peers(x, y):
     y = get_parent(y)
   return (x, y)
 
+# Returns x if x is an ancestor of y, y if y is an ancestor of x,
+# otherwise None.  Constant time for indexed records.
+
+def which_above(x, y):
+  H = get_hierarchy(x, y)
+  if H:
+    i = hierarchy_position(H, x)
+    j = hierarchy_position(H, y)
+    if i != None and j != None:
+      if i <= j <= H.end[i]: return x
+      if j <= i <= H.end[j]: return y
+      return None
+  (x_peer, y_peer) = find_peers(x, y)
+  return x_peer if x_peer is y_peer else None
+
 # MRCA within the same tree
 
 def mrca(x, y):
   if x == y: return x
+  H = get_hierarchy(x, y)
+  if H:
+    i = hierarchy_position(H, x)
+    j = hierarchy_position(H, y)
+    if i != None and j != None:
+      return H.records[get_lca_index(get_source(x)).lca(i, j)]
   (x, y) = find_peers(x, y)
   while not (x is y):
     x = get_parent(x)
@@ -119,6 +153,12 @@ def simple_le(x, y):
   # Is x <= y?  Scan from x upwards, see if we find y
   if x == y: return True
   assert not is_accepted(y)
+  H = get_hierarchy(x, y)
+  if H:
+    i = hierarchy_position(H, y)
+    j = hierarchy_position(H, x)
+    if i != None and j != None:
+      return i <= j <= H.end[i]
   stop = get_level(y)
   while get_level(x) > stop:
     x = get_parent(x)    # y1 > previously, level(y1) < previously
@@ -147,6 +187,11 @@ def simple_intersect(x, y):
 # 2nd result is True if x is a synonym, False otherwise
 #
 def get_level(x, default=None):
+  H = get_source(x).hierarchy
+  if H:
+    i = hierarchy_position(H, x)
+    if i != None:
+      return H.depth[i] + 1     # top is level 1
   i = really_get_level(x, None)
   if i == None:
     set_level(x, "cycle")
@@ -182,3 +227,122 @@ def ensure_levels(S):
 def descends_from(x, y):
   return get_level(y) < get_level(x)
 
+# ----- Lowest common ancestors
+
+# Constant-time LCA over a source's hierarchy index, using a sparse
+# table over preorder numbers.  For i < j with i not an ancestor of j,
+# the shallowest record numbered in (i, j] is a child of the LCA, so
+# the LCA is that record's parent.  Built on first use, O(n log n).
+
+class LcaIndex:
+  def __init__(self, H):
+    self.hierarchy = H
+    depth = H.depth
+    n = len(depth)
+    level = array('i', range(n))
+    self.table = [level]        # table[k][i] = shallowest in [i, i+2^k)
+    k = 1
+    while (1 << k) <= n:
+      half = 1 << (k - 1)
+      level = array('i', (a if depth[a] <= depth[b] else b
+                          for (a, b) in zip(level, level[half:])))
+      self.table.append(level)
+      k += 1
+
+  def lca(self, i, j):          # preorder numbers
+    H = self.hierarchy
+    if i > j: (i, j) = (j, i)
+    if j <= H.end[i]: return i  # i is j or an ancestor of j
+    k = (j - i).bit_length() - 1
+    level = self.table[k]
+    a = level[i + 1]
+    b = level[j - (1 << k) + 1]
+    return H.parent[a if H.depth[a] <= H.depth[b] else b]
+
+def get_lca_index(S):
+  L = S.lca_index
+  if not L:
+    L = LcaIndex(S.hierarchy)
+    S.lca_index = L
+  return L
+
+# ----- Nearest ancestor of a given rank
+
+# For each rank asked about, the preorder number of the nearest
+# ancestor (or self) of each record having that rank, or -1, filled in
+# top-down in one pass over the hierarchy index.  Ranks are coded as
+# small integers up front so that the passes don't look at records.
+# With accepted=True only accepted records count, so that 'species'
+# gives the nearest accepted species.
+
+class RankIndex:
+  def __init__(self, H):
+    self.hierarchy = H
+    self.codes = {}             # rank name -> code
+    self.rank_code = array('i', (self.code(get_rank(x, None))
+                                 for x in H.records))
+    self.accepted = bytearray(is_accepted(x) for x in H.records)
+    self.nearest = {}           # (code, accepted) -> array
+
+  def code(self, rank):
+    c = self.codes.get(rank)
+    if c == None:
+      c = len(self.codes)
+      self.codes[rank] = c
+    return c
+
+  def ancestor_of_rank(self, i, rank, accepted=False):  # preorder number
+    key = (self.code(rank), accepted)
+    nearest = self.nearest.get(key)
+    if nearest == None:
+      nearest = self.index_rank(*key)
+      self.nearest[key] = nearest
+    return nearest[i]
+
+  def index_rank(self, c, accepted):
+    parent = self.hierarchy.parent
+    rank_code = self.rank_code
+    ok = self.accepted
+    nearest = array('i', [-1]) * len(parent)
+    for i in range(len(parent)):
+      if rank_code[i] == c and (ok[i] or not accepted):
+        nearest[i] = i
+      elif parent[i] >= 0:
+        nearest[i] = nearest[parent[i]]
+    return nearest
+
+def get_rank_index(S):
+  R = S.rank_index
+  if not R:
+    R = RankIndex(S.hierarchy)
+    S.rank_index = R
+  return R
+
+# Nearest ancestor of x (or x itself) of the given rank, or None.
+# Records not covered by a hierarchy index (e.g. workspace records)
+# climb the superior chain.
+
+def get_ancestor_of_rank(x, rank, accepted=False):
+  S = get_source(x)
+  H = S.hierarchy
+  if H:
+    i = hierarchy_position(H, x)
+    if i != None:
+      j = get_rank_index(S).ancestor_of_rank(i, rank, accepted)
+      return H.records[j] if j >= 0 else None
+  while not (get_rank(x, None) == rank and (not accepted or is_accepted(x))):
+    sup = get_superior(x, None)
+    if sup == None:
+      return None
+    x = sup.record
+  return x
+
+# The hierarchy index (see checklist.index_hierarchy) shared by x and y,
+# if there is one
+
+def get_hierarchy(x, y):
+  S = get_source(x)
+  if S is get_source(y):
+    return S.hierarchy
+  return None
+
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Binary snapshots of ingested checklists.
+#
+# Reading a big checklist from CSV means re-parsing every row,
+# resolving every parent/accepted id, normalizing ranks, parsing
+# names, and indexing the hierarchy.  A snapshot saves the result of
+# all that: the column store, the superior links, the children and
+# synonym lists, the parsed names (Parts), and the hierarchy index,
+# with records referred to by number rather than by id.  Loading it
+# is one unpickling plus a linear pass to rebuild the records.
+#
+# rows.open recognizes a snapshot file by its magic number, and
+# rows_to_checklist (hence ingest_workspace) accepts the result in
+# place of a CSV row iterable, so a snapshot can be given anywhere
+# a --A or --B checklist is expected.  Iterating over a snapshot
+# yields its rows, header first, just as a CSV file would.
+
+import sys, io, pickle, argparse
+from array import array
+
+import property as prop
+import checklist, parse, rows
+from util import log, VERSION, MISSING
+from checklist import Predicate, Hierarchy, all_records, \
+  get_superior, get_children, get_synonyms, get_parts, \
+  set_source, set_superior, set_children, set_synonyms, set_parts_cache, \
+  primary_key_prop, source_prop, superior_prop
+
+MAGIC = rows.SNAPSHOT_MAGIC
+SNAPSHOT_FORMAT = 1
+
+# -----------------------------------------------------------------------------
+# Writing
+
+def write_snapshot(S, outport):        # outport is a binary file
+  outport.write(MAGIC)
+  pickle.dump(snapshot_payload(S), outport, protocol=pickle.HIGHEST_PROTOCOL)
+
+# Records are numbered in registration order, with top last (number n)
+
+def snapshot_payload(S):
+  records = list(all_records(S))
+  n = len(records)
+  number = prop.mep()
+  for (i, x) in enumerate(records):
+    prop.mep_set(number, x, i)
+  prop.mep_set(number, S.top, n)
+  every = records + [S.top]
+
+  plan = records[0].plan if records else prop.make_plan(())
+  store = prop.make_store(plan, int_props=checklist.INT_KEY_PROPS
+                          if checklist.INT_KEYS else ())
+  shadows = []                  # (pos, i) where a MISSING was set
+  for (i, x) in enumerate(records):
+    assert x.plan is plan
+    row = list(x.positional)
+    for pos in range(len(row)):
+      if row[pos] is prop._SHADOW:
+        shadows.append((pos, i))
+        row[pos] = MISSING
+    store.append(row)
+  store.seal()
+
+  # Superior links; -1 means none
+  sup = array('i'); relation = array('i'); span = array('i'); notes = []
+  for x in records:
+    p = get_superior(x, None)
+    sup.append(prop.mep_get(number, p.record) if p else -1)
+    relation.append(p.relation if p else 0)
+    span.append(p.span if p else 0)
+    notes.append(p.note if p else MISSING)
+
+  # Inferiors, in CSR form over all n+1 records
+  child_start = array('i', [0]); child_list = array('i')
+  synonym_start = array('i', [0]); synonym_list = array('i')
+  for x in every:
+    child_list.extend(prop.mep_get(number, c) for c in get_children(x, ()))
+    child_start.append(len(child_list))
+    synonym_list.extend(prop.mep_get(number, c) for c in get_synonyms(x, ()))
+    synonym_start.append(len(synonym_list))
+
+  # Any other plain values that ingest left behind (e.g. a rank
+  # cleared by normalize_ranks when there's no rank column)
+  linked = {source_prop.id, superior_prop.id,
+            checklist.children_prop.id, checklist.synonyms_prop.id,
+            checklist.parts_cache_prop.id}
+  lookedup = {}
+  for (i, x) in enumerate(records):
+    for (id, val) in x.lookedup.items():
+      if id in linked: continue
+      if val is prop._SHADOW or isinstance(val, (str, int, type(None))):
+        label = prop.propid_label(id)
+        lookedup.setdefault(label, {})[i] = val
+
+  parts = [tuple(get_parts(x)) for x in records]
+
+  H = S.hierarchy or checklist.index_hierarchy(S)
+  hierarchy = (array('i', (prop.mep_get(number, x) for x in H.records)),
+               array('i', H.end), array('i', H.depth),
+               array('i', H.parent), array('i', H.postorder),
+               array('i', H.child_start), array('i', H.child_list),
+               array('i', H.synonym_start), array('i', H.synonym_list))
+
+  return {'format': SNAPSHOT_FORMAT,
+          'version': VERSION,
+          'header': [p.label for p in plan.props],
+          'count': n,
+          'columns': store.columns,
+          'shadows': shadows,
+          'superior': (sup, relation, span, notes),
+          'inferiors': (child_start, child_list, synonym_start, synonym_list),
+          'lookedup': lookedup,
+          'parts': parts,
+          'hierarchy': hierarchy}
+
+# -----------------------------------------------------------------------------
+# Reading
+
+def read_snapshot(inport):             # inport is a binary file
+  magic = inport.read(len(MAGIC))
+  assert magic == MAGIC, "not a checklist snapshot"
+  payload = pickle.load(inport)
+  assert payload['format'] == SNAPSHOT_FORMAT, \
+    ("snapshot format %s, expected %s" % (payload['format'], SNAPSHOT_FORMAT))
+  assert payload['version'] == VERSION, \
+    ("snapshot is from version %s, this is version %s; please regenerate" %
+     (payload['version'], VERSION))
+  return Snapshot(payload)
+
+class Snapshot:
+  def __init__(self, payload):
+    self.payload = payload
+    self.plan = prop.make_plan_from_header(payload['header'])
+    self.store = prop.restore_store(self.plan, payload['columns'],
+                                    payload['count'])
+    for (pos, i) in payload['shadows']:
+      self.store.put(pos, i, prop._SHADOW)
+
+  # Rows, as if read from the CSV file the snapshot was made from
+  def __iter__(self):
+    yield self.payload['header']
+    width = len(self.plan.props)
+    for i in range(self.store.count):
+      row = [self.store.get(pos, i) for pos in range(width)]
+      yield [MISSING if val is prop._SHADOW else val for val in row]
+
+  # Fully linked Source, as rows_to_checklist would make it
+  def to_checklist(self, meta):
+    d = self.payload
+    S = checklist.Source(meta)
+    Q = prop.make_context()
+    register = prop.get_registrar(primary_key_prop, Q)
+    records = [prop.construct_stored(self.store, i)
+               for i in range(self.store.count)]
+    for x in records:
+      register(x)
+      set_source(x, S)
+    S.context = Q
+    S.register = register
+    every = records + [S.top]
+
+    (sup, relation, span, notes) = d['superior']
+    for (x, j, rel, sp, note) in zip(records, sup, relation, span, notes):
+      if j >= 0:
+        set_superior(x, Predicate(rel, every[j], sp, note))
+
+    (child_start, child_list, synonym_start, synonym_list) = d['inferiors']
+    for (k, x) in enumerate(every):
+      (a, b) = (child_start[k], child_start[k+1])
+      if a < b: set_children(x, [every[j] for j in child_list[a:b]])
+      (a, b) = (synonym_start[k], synonym_start[k+1])
+      if a < b: set_synonyms(x, [every[j] for j in synonym_list[a:b]])
+
+    for (label, vals) in d['lookedup'].items():
+      id = prop.declare_property(label).id
+      for (i, val) in vals.items():
+        if val == prop._SHADOW: val = prop._SHADOW
+        records[i].lookedup[id] = val
+
+    for (x, t) in zip(records, d['parts']):
+      set_parts_cache(x, parse.Parts(*t))
+
+    (order, end, depth, parent, postorder,
+     child_start, child_list, synonym_start, synonym_list) = d['hierarchy']
+    H_records = [every[k] for k in order]
+    position = prop.mep()
+    for (i, x) in enumerate(H_records):
+      prop.mep_set(position, x, i)
+    S.hierarchy = Hierarchy(H_records, position,
+                            list(end), list(depth), list(parent),
+                            list(postorder),
+                            list(child_start), list(child_list),
+                            list(synonym_start), list(synonym_list))
+    log("# %s: %s records from snapshot" % (meta.get('tag'), len(records)))
+    return S
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="""
+    Ingest a checklist and save it as a binary snapshot, which any of
+    the tools that take --A and --B can read in place of the CSV file.
+    Snapshots are specific to the version of the software that wrote
+    them.
+    """)
+  parser.add_argument('--input', help="the checklist, as path name or newick",
+                      default='-')
+  parser.add_argument('--output', help="path name for the snapshot",
+                      default='-')
+  args=parser.parse_args()
+  with rows.open(args.input) as r:
+    S = checklist.rows_to_checklist(r.rows(), {'tag': "snapshot"})
+  if args.output == '-':
+    write_snapshot(S, sys.stdout.buffer)
+  else:
+    with io.open(args.output, 'wb') as outport:
+      write_snapshot(S, outport)
@@ -1,38 +1,146 @@
 #!/usr/bin/env python3
 
-import sys, argparse, csv
+import sys, os, argparse, csv, heapq, tempfile
+import multiprocessing
 from util import windex
 
-def sort_csv(inport, key_columns, outport):
+MERGE_FANIN = 64        # max number of runs to merge at once
+
+def sort_csv(inport, key_columns, outport, max_memory=None, jobs=1):
   reader = csv.reader(inport)
   header = next(reader)
   key_positions = [windex(header, pk_col) for pk_col in key_columns.split(",")]
   print("# sort key positions: %s" % (key_positions,), file=sys.stderr)
 
-  def sort_key(row):
-    return (tuple(row[pk_pos] for pk_pos in key_positions), row)
-
-  rows = read_rows(reader)
+  if max_memory:
+    rows = external_sort(reader, key_positions, max_memory, jobs)
+  else:
+    rows = read_rows(reader)
+    print("# sorting %s rows" % len(rows), file=sys.stderr)
+    rows.sort(key=sort_key_function(key_positions))
   writer = csv.writer(outport)
-  print("# sorting %s rows" % len(rows), file=sys.stderr)
-  rows.sort(key=sort_key)
   writer.writerow(header)
   for row in rows:
     assert len(row) == len(header)
     writer.writerow(row)
 
+# Rows are ordered by key columns, then by the whole row, so that the
+# order doesn't depend on the order of the input
+
+def sort_key_function(key_positions):
+  def sort_key(row):
+    return (tuple(row[pk_pos] for pk_pos in key_positions), row)
+  return sort_key
+
 def read_rows(reader):
   all_rows = []
   for row in reader:
     all_rows.append(row)
   return all_rows
 
+# -----------------------------------------------------------------------------
+# Sorting in bounded memory: sort runs of rows that fit in memory,
+# write each to a temporary file, and merge them.  Returns a
+# generator of sorted rows.
+
+def external_sort(reader, key_positions, max_memory, jobs=1):
+  tempdir = tempfile.TemporaryDirectory(prefix="sortcsv-")
+  try:
+    # With several workers, up to jobs runs are being sorted while
+    # another is read
+    run_memory = max_memory // (jobs + 1) if jobs > 1 else max_memory
+    runs = write_runs(reader, key_positions, run_memory, tempdir.name, jobs)
+    print("# sorted %s runs" % len(runs), file=sys.stderr)
+    sort_key = sort_key_function(key_positions)
+    while len(runs) > MERGE_FANIN:
+      runs = [merge_runs(runs[i:i+MERGE_FANIN], sort_key,
+                         run_path(tempdir.name, len(runs) + i))
+              for i in range(0, len(runs), MERGE_FANIN)]
+    inports = [open(path, 'r', newline='') for path in runs]
+    yield from heapq.merge(*map(csv.reader, inports), key=sort_key)
+    for inport in inports: inport.close()
+  finally:
+    tempdir.cleanup()
+
+def write_runs(reader, key_positions, run_memory, dirname, jobs):
+  runs = []
+  pool = multiprocessing.get_context('fork').Pool(jobs) if jobs > 1 else None
+  pending = []
+  try:
+    run = []
+    size = 0
+    for row in reader:
+      run.append(row)
+      size += row_size(row)
+      if size >= run_memory:
+        if pool:
+          # At most jobs runs in flight, so memory stays bounded
+          while len(pending) - len(runs) >= jobs:
+            runs.append(pending[len(runs)].get())
+        pending.append(start_run(run, key_positions,
+                                 run_path(dirname, len(pending)), pool))
+        run = []
+        size = 0
+    if run or not pending:
+      pending.append(start_run(run, key_positions,
+                               run_path(dirname, len(pending)), pool))
+    runs += [p.get() if pool else p for p in pending[len(runs):]]
+  finally:
+    if pool: pool.close(); pool.join()
+  return runs
+
+# Rough number of bytes taken by a row in memory
+
+def row_size(row):
+  return 64 + sum(57 + len(field) for field in row)
+
+def run_path(dirname, i):
+  return os.path.join(dirname, "run%s.csv" % i)
+
+def start_run(run, key_positions, path, pool):
+  if pool:
+    return pool.apply_async(sort_run, (run, key_positions, path))
+  else:
+    return sort_run(run, key_positions, path)
+
+def sort_run(run, key_positions, path):
+  run.sort(key=sort_key_function(key_positions))
+  with open(path, 'w', newline='') as outport:
+    csv.writer(outport).writerows(run)
+  return path
+
+def merge_runs(paths, sort_key, path):
+  inports = [open(p, 'r', newline='') for p in paths]
+  with open(path, 'w', newline='') as outport:
+    csv.writer(outport).writerows(heapq.merge(*map(csv.reader, inports),
+                                              key=sort_key))
+  for (p, inport) in zip(paths, inports):
+    inport.close()
+    os.remove(p)
+  return path
+
+# E.g. 500M, 2G
+
+def parse_size(s):
+  units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+  if s[-1].upper() in units:
+    return int(float(s[:-1]) * units[s[-1].upper()])
+  return int(s)
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description="""
-    TBD
+    Sort CSV rows from standard input by the given key columns, and
+    write them to standard output.
     """)
   parser.add_argument('--key',
                       help='comma-separated names of columns to sort by')
+  parser.add_argument('--max-memory', dest='max_memory', default=None,
+                      help="""sort in runs of at most this much memory
+                              (e.g. 2G), merging them from temporary files""")
+  parser.add_argument('--jobs', type=int, default=1,
+                      help="with --max-memory, sort runs in this many processes")
   # List of fields stored in database or graphdb should be an arg.
   args=parser.parse_args()
-  sort_csv(sys.stdin, args.key, sys.stdout)
+  sort_csv(sys.stdin, args.key, sys.stdout,
+           max_memory=parse_size(args.max_memory) if args.max_memory else None,
+           jobs=args.jobs)
@@ -13,8 +13,8 @@
 
 debug = False
 
-import sys, os, csv, argparse
-import util
+import sys, os, csv, pickle, argparse
+import util, compressed
 
 from util import MISSING, windex, csv_parameters
 
@@ -28,27 +28,45 @@ def extract_subset(infile, hier_file, root_name, outfile):
   write_subset(infile, root_tid, all, topo, outfile)
 
 def write_subset(infile, root_name, all, topo, outfile):
+  write_subsets(infile, [(all, outfile)])
+
+# One pass over the checklist, writing each row to every subset that
+# has it.  subsets is a list of (all, outfile).
+
+def write_subsets(infile, subsets):
   reader = csv.reader(infile)
   head = next(reader)
+  writers = [(all, SubsetWriter(head, all, outfile))
+             for (all, outfile) in subsets]
+  for row in reader:
+    for (all, writer) in writers:
+      if row[writer.tid_column] in all:
+        writer.writerow(row)
 
-  tid_column = head.index("taxonID") 
-  aid_column = head.index("acceptedNameUsageID")
-  pid_column = head.index("parentNameUsageID")
+# Writes rows of a subset, cutting links to records outside of it
 
-  writer = csv.writer(outfile)
-  writer.writerow(head)
-  for row in reader:
-    tid = row[tid_column]
-    if tid in all:
-      aid = row[aid_column]
-      if not aid in all:
-        row[aid_column] = MISSING
-      if aid == tid:            # flush redundant accepted id
-        row[aid_column] = MISSING
-      pid = row[pid_column]
-      if not pid in all:
-        row[pid_column] = MISSING
-      writer.writerow(row)
+class SubsetWriter:
+  def __init__(self, head, all, outfile):
+    self.all = all
+    self.tid_column = head.index("taxonID") 
+    self.aid_column = head.index("acceptedNameUsageID")
+    self.pid_column = head.index("parentNameUsageID")
+    self.writer = csv.writer(outfile)
+    self.writer.writerow(head)
+
+  def writerow(self, row):
+    all = self.all
+    row = row + []
+    tid = row[self.tid_column]
+    aid = row[self.aid_column]
+    if not aid in all:
+      row[self.aid_column] = MISSING
+    if aid == tid:            # flush redundant accepted id
+      row[self.aid_column] = MISSING
+    pid = row[self.pid_column]
+    if not pid in all:
+      row[self.pid_column] = MISSING
+    self.writer.writerow(row)
 
 # Transitive closure of accepted records
 
@@ -58,26 +76,28 @@ def closure(topo, root_tid):
   (children, _) = topo[root_tid]
   print("-- subset: root has %s children" % len(children), file=sys.stderr)
   all = {}
-  empty = []
-  def descend(id):
+  stack = [root_tid]
+  while stack:
+    id = stack.pop()
     if not id in all:
       all[id] = True
       if id in topo:
         (children, synonyms) = topo[id]
-        for child in children:
-          descend(child)
-        for syn in synonyms:
-          descend(syn)
-  descend(root_tid)
+        stack.extend(synonyms)
+        stack.extend(children)
   print("-- subset: %s items in transitive closure" % len(all), file=sys.stderr)
   return all
 
 def read_topology(hier_file, root_name):
+  (topo, (root_tid,)) = read_topology_for_roots(hier_file, [root_name])
+  return (topo, root_tid)
+
+def read_topology_for_roots(hier_file, root_names):
   # Keyed by taxon id
   topo = {}
   # (delimiter, quotechar, mode) = csv_parameters(hier_path)
   counter = 0
-  root_tid = None
+  root_tids = [None] * len(root_names)
   print("# subset: scanning to obtain hierarchy",
         flush=True,
         file=sys.stderr)
@@ -103,33 +123,35 @@ def read_topology(hier_file, root_name):
   for row in reader:
     counter += 1
     tid = row[tid_column]
-    parent_id = row[pid_column]
-    accepted_id = row[aid_column]
-    status = row[sid_column]
-    # Not clear which part of the record is authoritative when there
-    # is a conflict.
-    # (accepted_id and not accepted_id == tid))
-    if accepted_id != MISSING:
-      assert accepted_id != tid
-      (_, syns) = get_topo_record(accepted_id, topo)
-      syns.append(tid)
-    if parent_id != MISSING and parent_id != tid:
-      (children, _) = get_topo_record(parent_id, topo)
-      children.append(tid)
-    if (tid == root_name or
-        (name_column != None and row[name_column] == root_name) or
-        (sci_column != None and row[sci_column] == root_name)):
-      assert tid
-      root_tid = tid
+    add_links(topo, tid, row[pid_column], row[aid_column])
+    for (i, root_name) in enumerate(root_names):
+      if (tid == root_name or
+          (name_column != None and row[name_column] == root_name) or
+          (sci_column != None and row[sci_column] == root_name)):
+        assert tid
+        root_tids[i] = tid
 
   print("-- subset: %s hierarchy items of which %s have children and/or synonyms" %
         (counter, len(topo)), file=sys.stderr)
 
-  if root_tid == None:
-    print("*** Did not find taxon with id or name %s" % root_name)
-  if not root_tid in topo:
-    print("*** Did not find root taxon, taxon id %s name %s" % (root_tid, root_name))
-  return (topo, root_tid)
+  for (root_name, root_tid) in zip(root_names, root_tids):
+    if root_tid == None:
+      print("*** Did not find taxon with id or name %s" % root_name)
+    if not root_tid in topo:
+      print("*** Did not find root taxon, taxon id %s name %s" % (root_tid, root_name))
+  return (topo, root_tids)
+
+def add_links(topo, tid, parent_id, accepted_id):
+  # Not clear which part of the record is authoritative when there
+  # is a conflict.
+  # (accepted_id and not accepted_id == tid))
+  if accepted_id != MISSING:
+    assert accepted_id != tid
+    (_, syns) = get_topo_record(accepted_id, topo)
+    syns.append(tid)
+  if parent_id != MISSING and parent_id != tid:
+    (children, _) = get_topo_record(parent_id, topo)
+    children.append(tid)
 
 def get_topo_record(tid, topo):
   record = topo.get(tid)
@@ -138,6 +160,137 @@ def get_topo_record(tid, topo):
     topo[tid] = record
   return record
 
+# -----------------------------------------------------------------------------
+# Sidecar index, for extracting subsets of a big checklist over and
+# over: the topology, the byte offset of every row, and which row has
+# each name.  A subset is then read by seeking to its rows, rather
+# than by reading the whole file twice.
+
+INDEX_FORMAT = 1
+
+def index_path(hier_path):
+  return hier_path + ".subset-index"
+
+# Returns the index, making it (or making it again if the checklist
+# has changed since) if necessary
+
+def get_index(hier_path):
+  stat = os.stat(hier_path)
+  stamp = (stat.st_size, stat.st_mtime_ns)
+  path = index_path(hier_path)
+  if os.path.exists(path):
+    with open(path, 'rb') as inport:
+      index = pickle.load(inport)
+    if index.get('format') == INDEX_FORMAT and index['stamp'] == stamp:
+      print("-- subset: using index %s" % path, file=sys.stderr)
+      return index
+  index = make_index(hier_path)
+  index['stamp'] = stamp
+  temp = path + ".tmp"
+  with open(temp, 'wb') as outport:
+    pickle.dump(index, outport, protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(temp, path)
+  print("-- subset: wrote index %s" % path, file=sys.stderr)
+  return index
+
+def make_index(hier_path):
+  print("# subset: scanning to make index", flush=True, file=sys.stderr)
+  topo = {}
+  offsets = {}                  # taxonID -> byte offset of row
+  names = {}                    # name -> taxonID of last row with it
+  with compressed.open_file(hier_path, 'rb', read_ahead=False) as hier_file:
+    rows = rows_with_offsets(hier_file)
+    (_, head) = next(rows)
+    tid_column = windex(head, "taxonID") 
+    pid_column = windex(head, "parentNameUsageID")
+    aid_column = windex(head, "acceptedNameUsageID")
+    name_column = windex(head, "canonicalName")
+    sci_column = windex(head, "scientificName")
+    for (offset, row) in rows:
+      tid = row[tid_column]
+      add_links(topo, tid, row[pid_column], row[aid_column])
+      offsets[tid] = offset
+      if name_column != None: names[row[name_column]] = tid
+      if sci_column != None: names[row[sci_column]] = tid
+  print("-- subset: %s hierarchy items of which %s have children and/or synonyms" %
+        (len(offsets), len(topo)), file=sys.stderr)
+  return {'format': INDEX_FORMAT, 'header': head,
+          'topo': topo, 'offsets': offsets, 'names': names}
+
+# Yields (byte offset, row) for each row of a binary CSV file.  For a
+# compressed file the offsets are into the uncompressed text; seeking
+# to them is slow, but works, and rows are wanted in file order anyway.
+
+def rows_with_offsets(infile):
+  position = [infile.tell()]
+  def lines():
+    for line in infile:
+      position[0] += len(line)
+      yield line.decode('utf-8')
+  start = position[0]
+  for row in csv.reader(lines()):
+    yield (start, row)
+    start = position[0]
+
+# taxonID of the root, as read_topology would find it: the last row
+# whose taxonID or name is root_name
+
+def find_root(index, root_name):
+  offsets = index['offsets']
+  tids = [tid for tid in (root_name if root_name in offsets else None,
+                          index['names'].get(root_name))
+          if tid != None]
+  if not tids:
+    print("*** Did not find taxon with id or name %s" % root_name)
+    return None
+  return max(tids, key=lambda tid: offsets[tid])
+
+# Write subsets, reading just their rows (in file order)
+
+def write_indexed_subsets(hier_path, index, subsets):
+  writers = [(all, SubsetWriter(index['header'], all, outfile))
+             for (all, outfile) in subsets]
+  offsets = index['offsets']
+  wanted = set()
+  for (all, _) in subsets:
+    wanted.update(offsets[tid] for tid in all if tid in offsets)
+  with compressed.open_file(hier_path, 'rb', read_ahead=False) as hier_file:
+    for offset in sorted(wanted):
+      hier_file.seek(offset)
+      (_, row) = next(rows_with_offsets(hier_file))
+      for (all, writer) in writers:
+        if row[writer.tid_column] in all:
+          writer.writerow(row)
+
+# Roots are given by taxonID or name; one output file per root
+
+def root_file_name(dest, root_name):
+  return os.path.join(dest, root_name.replace(' ', '_').replace('/', '_')
+                      + ".csv")
+
+def extract_subsets(infile, hier_path, root_names, dest, use_index):
+  if use_index:
+    index = get_index(hier_path)
+    (topo, root_tids) = (index['topo'],
+                         [find_root(index, name) for name in root_names])
+  else:
+    with compressed.open_file(hier_path, 'r') as hier_file:
+      (topo, root_tids) = read_topology_for_roots(hier_file, root_names)
+  outfiles = []
+  subsets = []
+  for (root_name, root_tid) in zip(root_names, root_tids):
+    assert root_tid, root_name
+    assert root_tid in topo, root_tid
+    outfile = open(root_file_name(dest, root_name), 'w') if dest else sys.stdout
+    outfiles.append(outfile)
+    subsets.append((closure(topo, root_tid), outfile))
+  if use_index:
+    write_indexed_subsets(hier_path, index, subsets)
+  else:
+    write_subsets(infile, subsets)
+  for outfile in outfiles:
+    if outfile != sys.stdout: outfile.close()
+
 # extract_subset(checklist, taxonomy, root_name, outfile)
 
 if __name__ == '__main__':
@@ -146,6 +299,22 @@ if __name__ == '__main__':
                       help="file from which to extract complete hierarchy")
   parser.add_argument('--root',
                       help="taxonID or name of root of subtree to be extracted")
+  parser.add_argument('--roots',
+                      help="""taxonIDs or names of several roots (comma
+                              separated), one subset for each""")
+  parser.add_argument('--dest',
+                      help="with --roots, directory for the subsets")
+  parser.add_argument('--index', action='store_true',
+                      help="""use (making if necessary) an index of the
+                              hierarchy file, and take rows from it
+                              instead of from standard input""")
   args = parser.parse_args()
-  with open(args.hierarchy, 'r') as hier_file:
-    extract_subset(sys.stdin, hier_file, args.root, sys.stdout)
+  if args.roots or args.index:
+    root_names = args.roots.split(',') if args.roots else [args.root]
+    assert len(root_names) == 1 or args.dest, "--roots requires --dest"
+    if args.dest: os.makedirs(args.dest, exist_ok=True)
+    extract_subsets(sys.stdin, args.hierarchy, root_names, args.dest,
+                    args.index)
+  else:
+    with compressed.open_file(args.hierarchy, 'r') as hier_file:
+      extract_subset(sys.stdin, hier_file, args.root, sys.stdout)
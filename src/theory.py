@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 
 import property as prop
-import rcc5, checklist, workspace, simple, exemplar, typify
+import rcc5, checklist, workspace, simple, exemplar, typify, metrics
+
+try:
+  import numpy
+except ImportError:
+  numpy = None                  # compare_many falls back to block_relation
 
 from util import log
 from checklist import *
@@ -30,8 +35,10 @@ def theorize(AB, compute_exemplars=True):
     exemplar.find_exemplars(AB)
   # else: read them from a file
 
-  analyze_blocks(AB)               # does set_block(...)
-  compute_cross_mrcas(AB)
+  with metrics.stage("blocks"):
+    analyze_blocks(AB)               # does set_block(...)
+  with metrics.stage("cross_mrcas"):
+    compute_cross_mrcas(AB)
 
 #-----------------------------------------------------------------------------
 # compare: The implementation of the RCC-5 theory of AB (A+B).
@@ -91,6 +98,126 @@ def compare_centrally(AB, u, v):
     # Different blocks (exemplar sets)
     return predicate(ship, v, note="exemplar set comparison")
 
+# -----------------------------------------------------------------------------
+# compare_many: compare(AB, u, v) for every u in us and v in vs.
+# Returns a list of rows of Predicates, one row per u.
+#
+# Each node's central predicate is found once, and the block
+# relations between the distinct central nodes are found all at once:
+# with NumPy, from a matrix of intersection sizes computed from
+# exemplar membership matrices; otherwise pair by pair using
+# block_relation.
+
+def compare_many(AB, us, vs):
+  u_centrals = [get_central_memoized(AB, u) for u in us]
+  v_centrals = [get_central_memoized(AB, v) for v in vs]
+  rel3s = [reverse_predicate(v, rel3r) for (v, rel3r) in zip(vs, v_centrals)]
+
+  (u1_list, u1_index) = index_records(rel1.record for rel1 in u_centrals)
+  (v1_list, v1_index) = index_records(rel3r.record for rel3r in v_centrals)
+  ships = block_relations(u1_list, v1_list)
+
+  within = {}                   # (u1.id, v1.id) -> Predicate
+  matrix = []
+  for (u, rel1) in zip(us, u_centrals):
+    u1 = rel1.record
+    ships_row = ships[u1_index[u1.id]]
+    row = []
+    for (v, rel3r, rel3) in zip(vs, v_centrals, rel3s):
+      v1 = rel3r.record
+      ship = ships_row[v1_index[v1.id]]
+      if ship == COMPARABLE:
+        rel2 = within.get((u1.id, v1.id))
+        if not rel2:
+          rel2 = compare_within_block(AB, u1, v1)
+          within[(u1.id, v1.id)] = rel2
+      else:
+        rel2 = predicate(ship, v1, note="exemplar set comparison")
+      row.append(compose_final(u, rel1, rel2, rel3))
+    matrix.append(row)
+  return matrix
+
+(get_central_cache, set_central_cache) = \
+  prop.get_set(prop.declare_property("central", inherit=False))
+
+def get_central_memoized(AB, u):
+  rel = get_central_cache(u, None)
+  if not rel:
+    rel = get_central(AB, u)
+    set_central_cache(u, rel)
+  return rel
+
+# Returns (list of distinct records, dict: record id -> list position)
+
+def index_records(records):
+  lst = []
+  index = {}
+  for x in records:
+    if not x.id in index:
+      index[x.id] = len(lst)
+      lst.append(x)
+  return (lst, index)
+
+# Matrix (list of rows) of block relations between central nodes
+
+def block_relations(us, vs):
+  blocks1 = [get_block(u) for u in us]
+  blocks2 = [get_block(v) for v in vs]
+  if numpy == None or not us or not vs:
+    return [[block_relation(b1, b2) for b2 in blocks2] for b1 in blocks1]
+
+  # Number the exemplars that occur on both sides; no others matter
+  on_left = set()
+  for b in blocks1: on_left.update(b)
+  column = {}
+  for b in blocks2:
+    for sid in b:
+      if sid in on_left and not sid in column:
+        column[sid] = len(column)
+  (rows1, cols1) = _memberships(blocks1, column)
+  (rows2, cols2) = _memberships(blocks2, column)
+
+  # Intersection sizes, summed over slices of the exemplars so that
+  # the membership matrices stay small
+  common = numpy.zeros((len(us), len(vs)), dtype=numpy.int64)
+  step = max(256, (1 << 22) // max(len(us), len(vs)))
+  for start in range(0, len(column), step):
+    m1 = _membership_matrix(len(us), rows1, cols1, start, step)
+    m2 = _membership_matrix(len(vs), rows2, cols2, start, step)
+    common += (m1 @ m2.T).astype(numpy.int64)
+
+  # Same decision procedure as block_relation
+  sizes1 = numpy.array([len(b) for b in blocks1], dtype=numpy.int64)
+  sizes2 = numpy.array([len(b) for b in blocks2], dtype=numpy.int64)
+  sub = common == sizes1[:, None]
+  sup = common == sizes2[None, :]
+  rel = numpy.full(common.shape, OVERLAP, dtype=numpy.int64)
+  rel[common == 0] = DISJOINT
+  rel[sup] = GT
+  rel[sub] = LT
+  rel[sub & sup] = COMPARABLE
+  return rel.tolist()
+
+# (row, column) coordinates of exemplar memberships
+
+def _memberships(blocks, column):
+  rows = []
+  cols = []
+  for (i, b) in enumerate(blocks):
+    for sid in b:
+      c = column.get(sid)
+      if c != None:
+        rows.append(i)
+        cols.append(c)
+  return (numpy.array(rows, dtype=numpy.int64),
+          numpy.array(cols, dtype=numpy.int64))
+
+def _membership_matrix(n, rows, cols, start, step):
+  m = numpy.zeros((n, step), dtype=numpy.float32)
+  mask = (cols >= start) & (cols < start + step)
+  m[rows[mask], cols[mask] - start] = 1
+  return m
+
 # --------------------
 # u and v are in opposite checklists but same block
 
@@ -216,17 +343,18 @@ def get_intersecting_species(AB, u):
       inters.append(s)
   return inters
 
-# Nearest ancestor that is an accepted species
+# Nearest ancestor that is an accepted species.  Synonyms aren't
+# accepted, so this is the same as climbing from u's accepted record.
 
 def get_species(u):             # u is in workspace
   AB = get_workspace(u)
-  s = local_accepted(AB, u)
-  while not is_species(s):
-    # TBD: use ranks_dict
-    rel = local_sup(AB, s)        # predicate
-    if rel: s = rel.record
-    else: return None
-  return s
+  y = simple.get_ancestor_of_rank(get_outject(u), 'species', accepted=True)
+  if y == None:
+    return None
+  if isinA(AB, u):
+    return AB.in_left(y)
+  else:
+    return AB.in_right(y)
 
 # A c = A b c, but A b b != A b  ... ?
 
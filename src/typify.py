@@ -3,10 +3,16 @@
 #  (A homotypy is an implication of a shared protonym, and protonyms
 #  are 1-1 with type specimens)
 
-import util
+import gc, multiprocessing
+import util, metrics
 import simple
 import homotypy
 
+try:
+  import numpy
+except ImportError:
+  numpy = None                  # see BATCH_PAIRS
+
 from parse import PROBE
 
 from util import log, MISSING
@@ -26,6 +32,7 @@ from specimen import sid_to_epithet, same_specimens, \
 
 from homotypy import ALL_IN, NO_WAY, MOTION, REVIEW, explain_classified
 from homotypy import relate_records
+from proximity import near_enough
 
 # Problem perhaps: This creates specimen objects even when they aren't matched.
 
@@ -35,18 +42,26 @@ def find_endohomotypics(AB):
 
 # Unify the type specimens of A with the type specimens of B.
 
-def find_typicals(AB, subprobs, get_estimate, last):
+def find_typicals(AB, subprobs, get_estimate, last, jobs=1):
   # This sets the 'typical' property of ... some ... records.
 
+  if jobs > 1:
+    all_pairs = relate_subproblems_in_parallel(subprobs, jobs)
+  else:
+    all_pairs = None
+
   n = 1
+  progress = metrics.progress("subproblems", len(subprobs))
   for (key, (us, vs)) in subprobs.items():  # For each subproblem
+    progress.step()
     if n % 1000 == 0 or PROBE in key:
       log("# Subproblem %s %s %s %s %s" %
           (n, len(us), len(vs), blurb(us[0]), blurb(vs[0])))
     # us and vs are sorted by 'unimportance' (i.e. most important first)
+    pairs = all_pairs[n-1] if all_pairs else None
     n += 1
 
-    (u_matches, v_matches) = find_matches(key, us, vs)
+    (u_matches, v_matches) = find_matches(key, us, vs, pairs)
 
     # u_specs and v_specs are sorted by 'unimportance'
     # u_matches : u_sid -> (v_clas, v_specs)
@@ -127,6 +142,12 @@ def find_typicals(AB, subprobs, get_estimate, last):
       # End u_sid loop.
       # end subproblem loop
 
+  counts = metrics.counters("matching")
+  counts["pairs pruned"] = (counts.get("pairs", 0) -
+                            counts.get("pairs compared", 0))
+  log("# %s of %s record pairs in subproblems pruned without comparing" %
+      (counts["pairs pruned"], counts.get("pairs", 0)))
+
   equate_typicals(AB.in_left(AB.A.top),
                        AB.in_right(AB.B.top))
 
@@ -137,7 +158,10 @@ def blorsb(spec):
   rec = typifies(spec)
   return "%s/%s" % (blorb(rec), get_primary_key(rec))
 
-def find_matches(key, us, vs):
+# pairs, if given, are the candidate matches for this subproblem as
+# computed by relate_pairs (perhaps in another process)
+
+def find_matches(key, us, vs, pairs=None):
   if any(map(monitor, us)):
     log("# Doing subproblem %s" % key)
     log("#  us = %s" % list(map(blurb, us),))
@@ -147,22 +171,142 @@ def find_matches(key, us, vs):
   v_matches = {}    # v_sid -> (class, [u_spec, ...])
                     # spec = (sid, u, v)
                     # Didn't count on multiple specs per sid!
+  if pairs == None:
+    pairs = relate_pairs(key, us, vs)
+  for (i, j, classified) in pairs:
+    (u, v) = (us[i], vs[j])
+    # relate_records checks proximity
+    observe_match(u, v, u_matches, classified)
+    observe_match(v, u, v_matches, classified)
+    if monitor(u):
+      log("# observe %s => %s = %s" %
+          (blurb(u), blurb(v), explain_classified(classified)))
+  return u_matches, v_matches
+
+# The all-pairs scan.  This only reads the records, so it can be done
+# for many subproblems at once in separate processes.
+# Yields (i, j, classified) for candidate matches, in (i, j) order.
+# Counts of pairs considered and compared go in counts.
+
+def relate_pairs(key, us, vs, counts=None):
+  if counts == None: counts = metrics.counters("matching")
+  counts["pairs"] = counts.get("pairs", 0) + len(us) * len(vs)
+  if PRUNE_PAIRS:
+    index = index_candidates(vs)
+    ijs = []
+    for u in us:
+      keys = homotypy.candidate_keys(get_parts(get_outject(u)))
+      ijs.append(sorted(set(j for k in keys for j in index.get(k, ()))))
+  else:
+    ijs = [range(0, len(vs))] * len(us)
+  compared = sum(map(len, ijs))
+  counts["pairs compared"] = counts.get("pairs compared", 0) + compared
+  if BATCH_PAIRS and compared >= BATCH_MIN:
+    yield from relate_pairs_in_batch(key, us, vs, ijs)
+    return
   for i in range(0, len(us)):
     u = us[i]
     if monitor(u): log("# Subproblem row: '%s' '%s'" % (key, blorb(u)))
-    for j in range(0, len(vs)):
-      v = vs[j]
-      classified = relate_records(u, v) # shows!
+    for j in ijs[i]:
+      classified = relate_records(u, vs[j]) # shows!
       if classified >= MOTION:
-        # relate_records checks proximity
-        observe_match(u, v, u_matches, classified)
-        observe_match(v, u, v_matches, classified)
-        if monitor(u):
-          log("# observe %s => %s = %s" %
-              (blurb(u), blurb(v), explain_classified(classified)))
-    # end j loop
-  # end i loop
-  return u_matches, v_matches
+        yield (i, j, classified)
+
+# Same as the loop in relate_pairs, but with the names compared all at
+# once (homotypy.compare_names_many).  Only pairs classified MOTION or
+# better are looked at one by one (MOTION still needs near_enough).
+# Pairs involving a monitored record go through relate_records so that
+# they're logged as usual.
+
+def relate_pairs_in_batch(key, us, vs, ijs):
+  intern = {}
+  P = homotypy.encode_parts([get_parts(get_outject(u)) for u in us], intern)
+  Q = homotypy.encode_parts([get_parts(get_outject(v)) for v in vs], intern)
+  I = numpy.repeat(numpy.arange(len(us)), list(map(len, ijs)))
+  J = numpy.concatenate([numpy.asarray(js, dtype=numpy.int64) for js in ijs])
+  classes = homotypy.compare_names_many(P, Q, I, J)
+  u_monitored = numpy.fromiter(map(monitor, us), dtype=bool, count=len(us))
+  v_monitored = numpy.fromiter(map(monitor, vs), dtype=bool, count=len(vs))
+  monitored = u_monitored[I] | v_monitored[J]
+  survivors = numpy.flatnonzero((classes >= MOTION) | monitored)
+  # Monitored us get their 'Subproblem row' line before their pairs
+  rows_to_log = numpy.flatnonzero(u_monitored).tolist()[::-1]
+  for (i, j, classified, m) in zip(I[survivors].tolist(),
+                                   J[survivors].tolist(),
+                                   classes[survivors].tolist(),
+                                   monitored[survivors].tolist()):
+    while rows_to_log and rows_to_log[-1] <= i:
+      log("# Subproblem row: '%s' '%s'" % (key, blorb(us[rows_to_log.pop()])))
+    if m:
+      classified = relate_records(us[i], vs[j])
+    elif classified == MOTION and not near_enough(us[i], vs[j]):
+      classified = REVIEW       # as in relate_records
+    if classified >= MOTION:
+      yield (i, j, classified)
+  for i in reversed(rows_to_log):
+    log("# Subproblem row: '%s' '%s'" % (key, blorb(us[i])))
+
+# Pairs that can't compare as MOTION or better (see
+# homotypy.candidate_keys) aren't compared at all.  The keys mirror
+# compare_names_1, which is what's used through VERSION 7.
+
+PRUNE_PAIRS = (util.VERSION <= 7)
+
+# Subproblems with at least BATCH_MIN pairs to compare are done by
+# relate_pairs_in_batch, if numpy is available.  It too follows
+# compare_names_1.
+
+BATCH_PAIRS = (util.VERSION <= 7 and numpy != None)
+BATCH_MIN = 64
+
+# candidate key -> [j, ...] for records vs[j] having that key
+
+def index_candidates(vs):
+  index = {}
+  for j in range(0, len(vs)):
+    for k in homotypy.candidate_keys(get_parts(get_outject(vs[j]))):
+      js = index.get(k)
+      if js == None:
+        index[k] = [j]
+      else:
+        js.append(j)
+  return index
+
+# Fan the all-pairs scans out to a pool of forked processes, biggest
+# subproblems first so that no process is left with a big one at the
+# end.  Returns a list of candidate lists in subprobs order; the
+# caller applies them (to the union-find structure) in that order, so
+# the outcome is the same as for a single process.
+
+_subprob_list = None            # inherited by forked workers
+
+def relate_subproblems_in_parallel(subprobs, jobs):
+  global _subprob_list
+  _subprob_list = list(subprobs.items())
+  order = sorted(range(len(_subprob_list)),
+                 key=lambda k: -(len(_subprob_list[k][1][0]) *
+                                 len(_subprob_list[k][1][1])))
+  log("* Matching %s subproblems in %s processes" % (len(order), jobs))
+  results = [None] * len(order)
+  chunk = max(1, min(64, len(order) // (jobs * 16)))
+  gc.freeze()                   # keep workers from copying the heap
+  try:
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+      counts = metrics.counters("matching")
+      for (k, pairs, worker_counts) in \
+          pool.imap_unordered(_relate_subproblem, order, chunksize=chunk):
+        results[k] = pairs
+        for (name, count) in worker_counts.items():
+          counts[name] = counts.get(name, 0) + count
+  finally:
+    gc.unfreeze()
+    _subprob_list = None
+  return results
+
+def _relate_subproblem(k):
+  (key, (us, vs)) = _subprob_list[k]
+  counts = {}
+  return (k, list(relate_pairs(key, us, vs, counts)), counts)
 
 # u_matches : u_sid -> (v_clas, v_specs)
 #   'spec' is short for 'specimen'
@@ -2,7 +2,7 @@
 
 # Make use of the output of gnparse, by adding new columns to the checklist
 
-import sys, csv, argparse
+import sys, csv, argparse, heapq
 import regex
 import util, parse
 from util import windex, MISSING, log
@@ -13,10 +13,13 @@ year_re = regex.compile(' ([12][0-9]{3})\\)?$')
 
 CANON_SAMPLE_LIMIT = 0    # for debugging
 ADD_TIPES = True
+WINDOW = 1000000          # max gnparse rows held waiting for their turn
 
-# Returns a generator
+# Returns a generator.
+# If by_id, gnparse rows are joined to checklist rows by Id (the row
+# number written by extract_names.py --ids), otherwise by position.
 
-def use_gnparse(gn_iter, check_iter):
+def use_gnparse(gn_iter, check_iter, by_id=False, window=WINDOW):
 
   # gnparse output: gn_iter / gn_header
   gn_header = next(gn_iter)
@@ -32,6 +35,8 @@ def use_gnparse(gn_iter, check_iter):
   auth_pos = windex(gn_header, "Authorship")
   year_pos = windex(gn_header, "Year")
   quality_pos = windex(gn_header, "Quality")
+  if by_id:
+    gn_iter = in_id_order(gn_iter, gn_header, window)
 
   checklist_header = next(check_iter)
   out_header = checklist_header + []
@@ -101,6 +106,41 @@ def use_gnparse(gn_iter, check_iter):
 
   log("-- use_gnparse: %s rows" % (row_count,))
 
+# Yields gnparse rows in Id order 1, 2, 3, ..., holding at most
+# window rows that arrive ahead of their turn.  Repeated headers (from
+# concatenated shards) and repeated Ids (from a shard that was run
+# twice) are skipped.
+
+def in_id_order(gn_iter, gn_header, window):
+  id_pos = windex(gn_header, "Id")
+  pending = {}
+  next_id = 1
+  for row in gn_iter:
+    if row == gn_header: continue
+    id = int(row[id_pos])
+    if id < next_id or id in pending: continue
+    pending[id] = row
+    while next_id in pending:
+      yield pending.pop(next_id)
+      next_id += 1
+    if len(pending) > window:
+      log("** use_gnparse: gnparse row %s is missing, or rows are too far out of order"
+          % next_id)
+      assert False
+  if pending:
+    log("** use_gnparse: gnparse row %s is missing" % next_id)
+    assert False
+
+# Merge shards, each in Id order, into one stream in Id order
+
+def merge_shards(gn_iters):
+  gn_header = None
+  for gn_iter in gn_iters:
+    gn_header = next(gn_iter)
+  id_pos = windex(gn_header, "Id")
+  yield gn_header
+  yield from heapq.merge(*gn_iters, key=lambda row: int(row[id_pos]))
+
 def fix_question_mark(s):
   if s.startswith('Xyzzy'):
     s = '?' + s[5:]
@@ -116,11 +156,26 @@ if __name__ == '__main__':
     """)
   parser.add_argument('--source',
                       help="name of file containing checklist")
+  parser.add_argument('--by-id', dest='by_id', action='store_true',
+                      help="""join by Id (from extract_names.py --ids)
+                              rather than by position""")
+  parser.add_argument('--window', type=int, default=WINDOW,
+                      help="with --by-id, how far out of order rows may be")
+  parser.add_argument('shards', nargs='*',
+                      help="""with --by-id, files of gnparse output (e.g. one
+                              per shard) to use instead of standard input""")
   args=parser.parse_args()
   assert args.source
-  gn_file = sys.stdin
+  gn_files = [open(path, "r") for path in args.shards]
+  if gn_files:
+    assert args.by_id, "gnparse shards require --by-id"
+    gn_iter = merge_shards([csv.reader(f) for f in gn_files])
+  else:
+    gn_iter = csv.reader(sys.stdin)
   with open(args.source, "r") as source_file:
     # rows is a generator
-    rows = use_gnparse(csv.reader(gn_file),
-                       csv.reader(source_file))
+    rows = use_gnparse(gn_iter,
+                       csv.reader(source_file),
+                       by_id=args.by_id, window=args.window)
     util.write_rows(rows, sys.stdout)
+  for f in gn_files: f.close()
@@ -2,6 +2,7 @@
 # Miscellaneous things used by more than one listtools module
 
 import sys, io, argparse, csv, hashlib
+import compressed
 from typing import NamedTuple, Any
 
 VERSION = 7
@@ -90,7 +91,7 @@ _corr = correspondence([1,2,3], [3,1])
 assert apply_correspondence(_corr, [10,20,30]) == [30,10]
 
 def csv_parameters(path):
-  if not path or ".csv" in path:
+  if not path or ".csv" in compressed.strip_suffix(path):
     return (",", '"', csv.QUOTE_MINIMAL)
   else:
     return ("\t", "\a", csv.QUOTE_NONE)
@@ -121,7 +122,7 @@ def stdopen(x, mode='r'):
       print('out %s' % mode, file=sys.stderr)
       return Trivial(sys.stdin)
   else:
-    return open(x, mode)
+    return compressed.open_file(x, mode)
 
 # 
 
@@ -18,6 +18,13 @@ def ingest_workspace(A_gen, B_gen, A_name='A', B_name='B'):
   log("*  Checklists loaded\n")
   return WS
 
+# Parse all names of both checklists up front, consulting the name
+# cache (see name_cache.py), in jobs processes
+
+def prepare_workspace_parts(AB, jobs=1):
+  prepare_parts(AB.A, jobs)
+  prepare_parts(AB.B, jobs)
+
 # -----------------------------------------------------------------------------
 # Sum / coproduct / merged checklist / theory workspace
 # Could be either just the matches (not a checklist), or the matches
@@ -27,6 +34,16 @@ def ingest_workspace(A_gen, B_gen, A_name='A', B_name='B'):
 
 REUSE_KEYS = True
 
+# VIEW says to treat the workspace as a view onto A and B: workspace
+# records are made when first injected rather than all up front, are
+# found through a per-side table indexed by the source record's row in
+# its column store (see property.Store) rather than through a
+# contextual property, and are not registered by primary key (nothing
+# looks them up that way).  Inherited fields are read through
+# cloned_from in one step.
+
+VIEW = True
+
 def make_workspace(A, B, meta={}):
   Q = prop.make_context()       # allows overriding A and/or B
   (get_inject, set_inject) = prop.get_set(inject_prop, context=Q)
@@ -34,13 +51,17 @@ def make_workspace(A, B, meta={}):
   register = prop.get_registrar(primary_key_prop, Q)
   pk_counter = [0]
   missing = False
+  (A_table, B_table) = (SideTable(), SideTable()) if VIEW else (None, None)
 
-  def ensure_injected(x):
+  def ensure_injected(x, table):
     assert not get_workspace(x)
-    z = get_inject(x, None)
+    z = table.get(x) if table else get_inject(x, None)
     if not z:
       z = prop.clone(x)         # sets canonical, scientific, rank, type etc
-      set_inject(x, z)          # contextual
+      if table:
+        table.put(x, z)
+      else:
+        set_inject(x, z)        # contextual
       set_outject(z, x)
       set_source(z, AB)
       if get_superior(z, None) != None:
@@ -54,16 +75,17 @@ def make_workspace(A, B, meta={}):
       # and not get_record(primary_key_prop, None)
       key = "%s!%s" % (get_source_tag(x), have_key)
       set_primary_key(z, key)
-      register(z)
+      if not table:
+        register(z)
     assert get_workspace(z)
     return z
 
   def _in_left(x):
     assert get_source(x) is A, ("expected left", get_source_tag(x))
-    return ensure_injected(x)
+    return ensure_injected(x, A_table)
   def _in_right(y):
     assert get_source(y) is B, ("expected right", get_source_tag(y))
-    return ensure_injected(y)
+    return ensure_injected(y, B_table)
   def _case(z, when_left, when_right):
     w = get_outject(z, None)
     assert w, blurb(z)
@@ -81,16 +103,19 @@ def make_workspace(A, B, meta={}):
   AB.context = Q
   AB.meta = meta
   AB.prefix = _prefix
+  AB.hierarchy = None           # AB gets relinked by jumble.py
 
   # Foo
   BA = AB.swap()
   BA.workspace = AB.workspace
   BA.A = AB.B
   BA.B = AB.A
+  BA.hierarchy = None
 
-  # Force local copies of all source records  -- really?
-  for y in all_records_inclusive(B): AB.in_right(y) # including top
-  for x in all_records_inclusive(A): AB.in_left(x)  # including top
+  if not VIEW:
+    # Force local copies of all source records  -- really?
+    for y in all_records_inclusive(B): AB.in_right(y) # including top
+    for x in all_records_inclusive(A): AB.in_left(x)  # including top
   # AB.top is not set at this point.  Needs to be determined independently.
   # See jumble.py
   #log("# taxonID counter: %s" % pk_counter[0])
@@ -100,6 +125,33 @@ def make_workspace(A, B, meta={}):
   AB.top = None                  # hmph.  see checklist.is_top
   return AB
 
+# Workspace record for each record of one source checklist, kept in a
+# list parallel to the source's column store.  Top, and any record
+# not in that store, go in a dict instead.
+
+class SideTable:
+  def __init__(self):
+    self.store = None
+    self.nodes = []
+    self.others = {}
+
+  def get(self, x):
+    row = x.positional
+    if isinstance(row, prop.StoredRow) and row.store is self.store:
+      return self.nodes[row.index]
+    return self.others.get(x.id)
+
+  def put(self, x, z):
+    row = x.positional
+    if isinstance(row, prop.StoredRow):
+      if self.store == None:
+        self.store = row.store
+        self.nodes = [None] * row.store.count
+      if row.store is self.store:
+        self.nodes[row.index] = z
+        return
+    self.others[x.id] = z
+
 # Is given synonym usage a senior synonym of its accepted usage?
 # In the case of splitting, we expect the synonym to be a senior
 # synonym of the item.